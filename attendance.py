@@ -5,19 +5,28 @@ Optimized with lazy loading and model caching for faster startup.
 """
 
 import os
-from db import add_attendance, get_user_by_userid
+from db import get_user_by_userid, fetch_all_users, users_version
+from attendance_writer import AttendanceWriter
+from model_cache import get_live_model
+from motion_gate import MotionGate
+from face_tracker import FaceTracker
+from detection import detect_faces
+from sample_store import fit_face
+from metrics import DETECT_SECONDS, PREDICT_SECONDS, FRAMES_PROCESSED, FACES_RECOGNIZED, FACES_UNKNOWN
 from datetime import datetime
 import time
+import atexit
 import threading
+from contextlib import nullcontext
 
 CASCADE_PATH = os.path.join("haarcascades", "haarcascade_frontalface_default.xml")
-TRAINER_DIR = "trainer"
+DEDUPE_SECONDS = 30  # don't log the same user again within this many seconds
 
 # Lazy-loaded and cached modules
 _cv2 = None
-_recognizer = None
-_face_cascade = None
-_label_map = None
+_thread_state = threading.local()  # per-thread CascadeClassifier: OpenCV's is not thread-safe
+_user_directory = None  # user_id -> users row, so the frame loop never hits the DB
+_user_directory_version = None
 
 def _lazy_import_cv2():
     """Import cv2 only when first needed."""
@@ -28,47 +37,151 @@ def _lazy_import_cv2():
     return _cv2
 
 def _lazy_load_model():
-    """Load LBPH recognizer and cascade classifier once (cached)."""
-    global _recognizer, _face_cascade, _label_map
-    if _recognizer is not None and _face_cascade is not None:
-        return _recognizer, _face_cascade, _label_map
-    
-    cv2 = _lazy_import_cv2()
-    
-    # Load label map
-    labels_path = os.path.join(TRAINER_DIR, "labels.txt")
-    if not os.path.exists(labels_path):
-        raise FileNotFoundError("labels.txt not found. Train model first.")
-    mapping = {}
-    with open(labels_path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            idx, uid = line.split(",", 1)
-            mapping[int(idx)] = uid
-    _label_map = mapping
-    
-    # Load LBPH recognizer
-    if not os.path.exists(os.path.join(TRAINER_DIR, "trainer.yml")):
-        raise FileNotFoundError("trainer.yml not found. Run train.py first.")
-    _recognizer = cv2.face.LBPHFaceRecognizer_create()
-    _recognizer.read(os.path.join(TRAINER_DIR, "trainer.yml"))
-    
-    # Load cascade classifier
-    _face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
-    
-    return _recognizer, _face_cascade, _label_map
-
-def attend(threshold=70):
+    """
+    Return (recognizer, face_cascade, label_map) for the active model version.
+    The first call loads everything; after that model_cache.LiveModel swaps in newly
+    published versions in the background, so loops call this once per frame.
+    The recognizer and label map are shared; the cascade belongs to the calling thread.
+    """
+    live = get_live_model()  # raises FileNotFoundError until a model is trained
+    if _user_directory is None:
+        _load_user_directory()
+    recognizer, label_map, _ = live.current()
+    return recognizer, _thread_cascade(), label_map
+
+def _thread_cascade():
+    """This thread's face cascade; detectMultiScale crashes when threads share one."""
+    cascade = getattr(_thread_state, "cascade", None)
+    if cascade is None:
+        cascade = _lazy_import_cv2().CascadeClassifier(CASCADE_PATH)
+        _thread_state.cascade = cascade
+    return cascade
+
+def _load_user_directory():
+    """Load every user into memory, indexed by user_id, stamped with the users version."""
+    global _user_directory, _user_directory_version
+    version = users_version()
+    _user_directory = {u["user_id"]: u for u in fetch_all_users()}
+    _user_directory_version = version
+    return _user_directory
+
+def _lookup_user(user_id):
+    """Return the user row for user_id from the in-memory directory."""
+    directory = _user_directory
+    if directory is None or _user_directory_version != users_version():
+        directory = _load_user_directory()
+    if user_id not in directory:
+        # Not in the snapshot: read once and remember the answer (even None)
+        # until the next users write bumps the version.
+        directory[user_id] = get_user_by_userid(user_id)
+    return directory[user_id]
+
+def attend(threshold=70, detection=None):
     """
     threshold: confidence threshold for LBPH — lower is better; adjust between 40-100 depending on camera/environment.
+    detection: optional detection.DetectionConfig (detection width, ROI, face size bounds).
     """
     cv2 = _lazy_import_cv2()
-    recognizer, face_cascade, label_map = _lazy_load_model()
+    _lazy_load_model()  # fail fast if no model is trained
     cam = cv2.VideoCapture(0)
+    writer = AttendanceWriter().start()
+    try:
+        _attend_loop(cv2, cam, writer, threshold, detection)
+    finally:
+        cam.release()
+        cv2.destroyAllWindows()
+        writer.close()
+        stats = writer.stats()
+        print(f"[INFO] Attendance stopped. Rows written: {stats['written']}, "
+              f"dropped: {stats['dropped']}, failed: {stats['failed']}.")
+
+def _send_email_async(user, user_id):
+    timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # hand off to the email delivery worker (non-blocking) to avoid slowing down attendance
+    try:
+        from email_notifier import queue_attendance_email
+        queue_attendance_email(user["email"], user["name"], user_id, timestamp_str)
+    except Exception as e:
+        print(f"[WARN] Could not send email async: {e}")
+
+def _mark_present(user_id, user, writer, last_logged, lock=None, confidence=None):
+    """Queue attendance + email unless user_id was logged within DEDUPE_SECONDS. Returns True if logged."""
+    now = time.time()
+    with lock or nullcontext():
+        if user_id in last_logged and (now - last_logged[user_id]) <= DEDUPE_SECONDS:
+            return False
+        last_logged[user_id] = now
+    info = {"name": user["name"], "email": user["email"]}
+    if confidence is not None:
+        info["confidence"] = round(float(confidence), 1)
+    writer.submit(user_id, status="Present", info=info)
+    _send_email_async(user, user_id)
+    return True
+
+def _predict_faces(recognizer, crops):
+    """
+    [(label, confidence)] for crops; one batched call when the engine has predict_many.
+    Crops are resized to the training sample size first, or distances drift with face size.
+    """
+    if not crops:
+        return []
+    crops = [fit_face(c) for c in crops]
+    with PREDICT_SECONDS.time():
+        if hasattr(recognizer, "predict_many"):
+            return recognizer.predict_many(crops)
+        return [recognizer.predict(c) for c in crops]
+
+def process_frame(gray, recognizer, face_cascade, label_map, threshold, writer, last_logged, lock=None,
+                  tracker=None, detection=None):
+    """
+    Detect and recognize every face in a grayscale frame and log attendance.
+    Returns [(x, y, w, h, text)] for drawing. `lock` guards last_logged when shared across threads.
+    With a FaceTracker, faces keep a track ID and are only re-predicted when the tracker asks.
+    `detection` is a detection.DetectionConfig (defaults to the environment settings).
+    """
+    results = []
+    with DETECT_SECONDS.time():
+        faces = detect_faces(face_cascade, gray, detection)
+    FRAMES_PROCESSED.inc()
+    assigned = tracker.update(faces) if tracker is not None else [(None, box) for box in faces]
+    pending = [i for i, (track, _) in enumerate(assigned) if track is None or track.needs_prediction()]
+    crops = [gray[y:y+h, x:x+w] for (x, y, w, h) in (assigned[i][1] for i in pending)]
+    predictions = dict(zip(pending, _predict_faces(recognizer, crops)))  # lower confidence = better match
+    for i, (track, (x, y, w, h)) in enumerate(assigned):
+        if i in predictions:
+            label, confidence = predictions[i]
+            if track is not None:
+                tracker.observe(track, label, confidence, threshold)
+        if track is not None:
+            if not track.stable:
+                results.append((x, y, w, h, f"#{track.id} identifying..."))
+                continue
+            label, confidence = track.label, track.confidence
+        text = "Unknown"
+        if label is not None and confidence < threshold and label in label_map:
+            user_id = label_map[label]
+            user = _lookup_user(user_id)
+            if user:
+                name = user["name"]
+                text = f"{name} ({user_id}) - {confidence:.1f}"
+                FACES_RECOGNIZED.inc()
+                _mark_present(user_id, user, writer, last_logged, lock, confidence)
+            else:
+                text = f"Unknown ({user_id})"
+                FACES_UNKNOWN.inc()
+        else:
+            text = f"Unknown - {confidence:.1f}"
+            FACES_UNKNOWN.inc()
+        if track is not None:
+            text = f"#{track.id} {text}"
+        results.append((x, y, w, h, text))
+    return results
 
+def _attend_loop(cv2, cam, writer, threshold, detection=None):
     last_logged = {}  # user_id -> last log timestamp to avoid duplicate logs within short span
+    gate = MotionGate()
+    tracker = FaceTracker()
+    results = []  # redrawn on frames the motion gate skips
 
     print("[INFO] Starting attendance. Press 'q' to quit.")
     while True:
@@ -76,48 +189,179 @@ def attend(threshold=70):
         if not ret:
             break
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5)
-        for (x, y, w, h) in faces:
-            face_img = gray[y:y+h, x:x+w]
-            label, confidence = recognizer.predict(face_img)  # lower confidence = better match
-            text = "Unknown"
-            if confidence < threshold and label in label_map:
-                user_id = label_map[label]
-                user = get_user_by_userid(user_id)
-                if user:
-                    name = user["name"]
-                    text = f"{name} ({user_id}) - {confidence:.1f}"
-                    # Avoid duplicate logging within, say, 30 seconds
-                    now = time.time()
-                    if user_id not in last_logged or (now - last_logged[user_id]) > 30:
-                        add_attendance(user_id, status="Present")
-                        timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        # send email asynchronously (non-blocking) to avoid slowing down attendance
-                        try:
-                            from email_notifier import send_attendance_email
-                            thread = threading.Thread(
-                                target=send_attendance_email,
-                                args=(user["email"], user["name"], user_id, timestamp_str),
-                                daemon=True
-                            )
-                            thread.start()
-                        except Exception as e:
-                            print(f"[WARN] Could not send email async: {e}")
-                        last_logged[user_id] = now
-                else:
-                    text = f"Unknown ({user_id})"
-            else:
-                text = f"Unknown - {confidence:.1f}"
-
+        if gate.should_process(gray):
+            recognizer, face_cascade, label_map = _lazy_load_model()  # picks up newly published models
+            results = process_frame(gray, recognizer, face_cascade, label_map,
+                                    threshold, writer, last_logged, tracker=tracker, detection=detection)
+        for (x, y, w, h, text) in results:
             cv2.rectangle(img, (x,y), (x+w, y+h), (0,255,0), 2)
             cv2.putText(img, text, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
         cv2.imshow("Attendance - Press q to Quit", img)
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
+    gs = gate.stats()
+    print(f"[INFO] Motion gate: {gs['frames_processed']} frames processed, "
+          f"{gs['frames_skipped_static']} skipped static, {gs['frames_skipped_rate']} skipped by rate cap.")
+    ts = tracker.stats()
+    print(f"[INFO] Tracker: {ts['predictions']} predictions for {ts['detections']} detections "
+          f"across {ts['tracks_started']} tracks.")
+
+# Shared by recognize_images() callers (the /api/recognize endpoint) so remote
+# cameras get the same dedupe window and batched writes as the live loop
+_remote_writer = None
+_remote_last_logged = {}
+_remote_lock = threading.Lock()
+
+def _get_remote_writer():
+    global _remote_writer
+    with _remote_lock:
+        if _remote_writer is None:
+            _remote_writer = AttendanceWriter().start()
+            atexit.register(_remote_writer.close)
+        return _remote_writer
+
+def decode_image(data):
+    """Decode encoded image bytes (JPEG, PNG, ...) to grayscale; None if undecodable."""
+    cv2 = _lazy_import_cv2()
+    import numpy as np
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+def recognize_images(images, threshold=70, cropped=False, log=False, detection=None):
+    """
+    Detect and recognize faces in grayscale images sent by a remote camera, using the
+    model cached by _lazy_load_model(). cropped=True treats each image as one face.
+    log=True records attendance (and email) for recognized users, with the usual dedupe.
+    Faces from every image are predicted in one batch.
+    Returns one list per image of
+    {"box": [x, y, w, h], "user_id", "name", "confidence", "recognized"}.
+    """
+    recognizer, face_cascade, label_map = _lazy_load_model()
+    writer = _get_remote_writer() if log else None
+    image_boxes = []
+    for gray in images:
+        if cropped:
+            boxes = [(0, 0, gray.shape[1], gray.shape[0])]
+        else:
+            with DETECT_SECONDS.time():
+                boxes = detect_faces(face_cascade, gray, detection)
+            FRAMES_PROCESSED.inc()
+        image_boxes.append(boxes)
+    predictions = iter(_predict_faces(recognizer, [gray[y:y+h, x:x+w] for gray, boxes in zip(images, image_boxes)
+                                                   for (x, y, w, h) in boxes]))
+    results = []
+    for boxes in image_boxes:
+        faces = []
+        for (x, y, w, h), (label, confidence) in zip(boxes, predictions):
+            user_id = label_map.get(label) if confidence < threshold else None
+            user = _lookup_user(user_id) if user_id else None
+            if user:
+                FACES_RECOGNIZED.inc()
+                if writer is not None:
+                    _mark_present(user_id, user, writer, _remote_last_logged, _remote_lock, confidence)
+            else:
+                FACES_UNKNOWN.inc()
+            faces.append({
+                "box": [int(x), int(y), int(w), int(h)],
+                "user_id": user_id if user else None,
+                "name": user["name"] if user else None,
+                "confidence": round(float(confidence), 1),
+                "recognized": bool(user),
+            })
+        results.append(faces)
+    return results
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+def _iter_frames(source):
+    """Yield BGR frames from a directory of images, a video file, or a device index."""
+    cv2 = _lazy_import_cv2()
+    if isinstance(source, str) and os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                img = cv2.imread(os.path.join(source, name))
+                if img is not None:
+                    yield img
+        return
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cam = cv2.VideoCapture(source)
+    if not cam.isOpened():
+        raise RuntimeError(f"Could not open video source {source!r}.")
+    try:
+        while True:
+            ret, img = cam.read()
+            if not ret:
+                break
+            yield img
+    finally:
+        cam.release()
 
-    cam.release()
-    cv2.destroyAllWindows()
-    print("[INFO] Attendance stopped.")
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))]
+
+def attend_headless(source, threshold=70, motion_gate=False, tracking=True, detection=None):
+    """
+    Run the attend() detect -> predict -> log path on a video file, a directory of
+    frames or a device index, with no display. Stops when the input is exhausted
+    and returns (and prints) throughput: frames/sec, faces/sec, p50/p99 frame latency.
+    motion_gate=True applies the same MotionGate as attend() (off by default so runs
+    are reproducible). tracking=False predicts every face on every frame.
+    """
+    cv2 = _lazy_import_cv2()
+    _lazy_load_model()
+    writer = AttendanceWriter().start()
+    last_logged = {}
+    gate = MotionGate() if motion_gate else None
+    tracker = FaceTracker() if tracking else None
+    latencies = []
+    faces = 0
+    start = time.perf_counter()
+    try:
+        for img in _iter_frames(source):
+            t0 = time.perf_counter()
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            if gate is None or gate.should_process(gray):
+                recognizer, face_cascade, label_map = _lazy_load_model()
+                faces += len(process_frame(gray, recognizer, face_cascade, label_map,
+                                           threshold, writer, last_logged, tracker=tracker,
+                                           detection=detection))
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        writer.close()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    latencies.sort()
+    stats = {
+        "frames": len(latencies),
+        "faces": faces,
+        "seconds": round(elapsed, 3),
+        "frames_per_sec": round(len(latencies) / elapsed, 2),
+        "faces_per_sec": round(faces / elapsed, 2),
+        "latency_ms_p50": round(1000 * _percentile(latencies, 50), 2),
+        "latency_ms_p99": round(1000 * _percentile(latencies, 99), 2),
+        "rows_written": writer.stats()["written"],
+    }
+    if gate is not None:
+        stats.update(gate.stats())
+    if tracker is not None:
+        stats.update(tracker.stats())
+    print(f"[INFO] Headless run: {stats['frames']} frames, {stats['faces']} faces in {stats['seconds']}s | "
+          f"{stats['frames_per_sec']} frames/sec, {stats['faces_per_sec']} faces/sec | "
+          f"p50 {stats['latency_ms_p50']} ms, p99 {stats['latency_ms_p99']} ms")
+    return stats
 
 if __name__ == "__main__":
-    attend(threshold=70)
+    import argparse
+    parser = argparse.ArgumentParser(description="Live attendance.")
+    parser.add_argument("--headless", metavar="SOURCE",
+                        help="video file, directory of frames or device index; runs without a display")
+    parser.add_argument("--threshold", type=float, default=70)
+    parser.add_argument("--motion-gate", action="store_true", help="skip static frames in headless mode")
+    parser.add_argument("--no-tracking", action="store_true", help="predict every face on every frame")
+    args = parser.parse_args()
+    if args.headless is not None:
+        attend_headless(args.headless, threshold=args.threshold, motion_gate=args.motion_gate,
+                        tracking=not args.no_tracking)
+    else:
+        attend(threshold=args.threshold)
@@ -0,0 +1,134 @@
+# attendance_writer.py
+"""
+Background attendance writer: the recognition loop enqueues events and a
+worker thread inserts them in batches, so the video loop never waits on the DB.
+
+Configuration (environment variables):
+- ATTENDANCE_FLUSH_INTERVAL (seconds, default 1.0)
+- ATTENDANCE_BATCH_SIZE (rows per transaction, default 100)
+- ATTENDANCE_QUEUE_SIZE (max pending events, default 1000)
+"""
+
+import os
+import queue
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from db import add_attendance_many
+from metrics import ATTENDANCE_QUEUE_DEPTH
+from events import attendance_events
+
+FLUSH_INTERVAL = float(os.environ.get("ATTENDANCE_FLUSH_INTERVAL", 1.0))
+BATCH_SIZE = int(os.environ.get("ATTENDANCE_BATCH_SIZE", 100))
+QUEUE_SIZE = int(os.environ.get("ATTENDANCE_QUEUE_SIZE", 1000))
+
+_STOP = object()
+
+# Running writers, so the queue-depth gauge can sum them at scrape time
+_live_writers = weakref.WeakSet()
+ATTENDANCE_QUEUE_DEPTH.set_function(lambda: sum(w.queue_depth() for w in list(_live_writers)))
+
+
+class AttendanceWriter:
+    """Drains a bounded queue of attendance events and writes them with executemany."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0  # rejected because the queue was full
+        self.failed = 0   # lost because the batch insert raised
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+            self._thread.start()
+            _live_writers.add(self)
+        return self
+
+    def submit(self, user_id: str, status="Present", login_time=None, info=None):
+        """
+        Queue one attendance event without blocking. Returns False if it was dropped.
+        info: extra fields (name, email, confidence) published to live listeners once written.
+        """
+        event = (user_id, login_time or datetime.now(), status, info or {})
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "queue_depth": self._queue.qsize(),
+            }
+
+    def close(self, timeout=None):
+        """Flush everything queued so far and stop the worker."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        _live_writers.discard(self)
+
+    def _next_batch(self):
+        """Collect up to batch_size events, waiting at most flush_interval. Returns (batch, stop)."""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                # Block for the first event; later ones only until flush_interval has passed
+                if deadline is None:
+                    item = self._queue.get()
+                else:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch, False
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            add_attendance_many((uid, t, status) for uid, t, status, _ in batch)
+            with self._lock:
+                self.written += len(batch)
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            print(f"[ERROR] Attendance batch of {len(batch)} failed: {e}")
+            return
+        for uid, t, status, info in batch:
+            attendance_events.publish(dict(info, user_id=uid, status=status,
+                                           login_time=t.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            self._flush(batch)
+            if stop:
+                break
@@ -0,0 +1,284 @@
+# benchmark.py
+"""
+Per-stage benchmark of the recognition hot path.
+
+Builds a synthetic frame corpus from the face crops in the sample store (or
+dataset/*.jpg): every enrolled "user" is a deterministic perturbation of a real
+crop, and each frame pastes k faces onto a noisy 1280x720 background. For each
+population size it trains a model in memory (OpenCV LBPH, or the NumPy engine
+with --engine numpy) and times cvtColor,
+detection, recognizer.predict, the user lookup (DB and in-memory directory) and
+the attendance write (synchronous insert and queued writer) separately.
+
+With --engine numpy --ann-lists N it also builds the approximate nearest-neighbour
+index (lbp_recognizer.py) and reports, for each --nprobe value, predict latency
+and recall@1 against exact search on a fixed probe set.
+
+Results are emitted as JSON so runs can be diffed between commits:
+    python benchmark.py --users 1,10,100,1000 --faces 1,4 --output bench.json
+
+By default a throwaway SQLite file is used; pass --use-configured-db to hit the
+database configured through the usual DB_* environment variables instead. The
+synthetic users (bench<run>_<n>) and their attendance rows are deleted again when
+the run ends, including after an error or Ctrl+C.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+
+def _configure_db(use_configured_db):
+    if use_configured_db:
+        return None
+    # Must happen before db is imported: it reads its settings at import time
+    tmp = tempfile.NamedTemporaryFile(prefix="bench_", suffix=".sqlite3", delete=False)
+    tmp.close()
+    os.environ["DB_USE_SQLITE"] = "1"
+    os.environ["DB_SQLITE_FILE"] = tmp.name
+    return tmp.name
+
+
+def _load_base_crops(cv2, np, size):
+    """Real face crops to derive synthetic users from."""
+    from sample_store import SampleStore
+    store = SampleStore()
+    if store.exists() and len(store):
+        return [np.array(img) for img in store.images()]
+    crops = []
+    for name in sorted(os.listdir("dataset")):
+        if name.endswith(".jpg"):
+            img = cv2.imread(os.path.join("dataset", name), cv2.IMREAD_GRAYSCALE)
+            if img is not None:
+                crops.append(cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA))
+    if not crops:
+        raise RuntimeError("No face crops found in the sample store or dataset/.")
+    return crops
+
+
+def _synthetic_face(cv2, np, base, seed):
+    """Deterministically perturb a real crop: small rotation/scale, brightness and noise."""
+    rng = np.random.default_rng(seed)
+    h, w = base.shape
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-12, 12), rng.uniform(0.9, 1.1))
+    img = cv2.warpAffine(base, m, (w, h), borderMode=cv2.BORDER_REFLECT)
+    img = img.astype(np.float32) * rng.uniform(0.8, 1.2) + rng.normal(0, 6, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def _make_frame(cv2, np, faces, rng, face_px=140):
+    """Paste faces onto a noisy background; returns (bgr_frame, boxes)."""
+    frame = rng.integers(90, 160, (720, 1280), dtype=np.uint8)
+    boxes = []
+    cols = 6
+    for i, face in enumerate(faces):
+        x = 40 + (i % cols) * (face_px + 60)
+        y = 40 + (i // cols) * (face_px + 60)
+        frame[y:y+face_px, x:x+face_px] = cv2.resize(face, (face_px, face_px))
+        boxes.append((x, y, face_px, face_px))
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), boxes
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        "n": n,
+        "median_ms": round(1000 * samples[n // 2], 4),
+        "p95_ms": round(1000 * samples[min(n - 1, int(0.95 * n))], 4),
+        "mean_ms": round(1000 * sum(samples) / n, 4),
+    }
+
+
+def _time(fn, repeat):
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def _bench_ann(cv2, np, recognizer, bases, n_users, gallery_size, ann_lists, nprobes, repeat, seed, rng):
+    """Latency and recall@1 (agreement with exact search) of the ANN index per nprobe."""
+    truth = [int(rng.integers(0, n_users)) for _ in range(50)]
+    probes = [_synthetic_face(cv2, np, bases[u % len(bases)], seed + 2 * 10**7 + i) for i, u in enumerate(truth)]
+    recognizer.ivf = None
+    recognizer._index = None
+    exact = [label for label, _ in recognizer.predict_many(probes)]
+    rows = [{
+        "stage": "predict_exact",
+        "users": n_users,
+        "gallery_size": gallery_size,
+        "probes": len(probes),
+        "accuracy": round(sum(a == t for a, t in zip(exact, truth)) / len(probes), 3),
+        **_summary(_time(lambda: recognizer.predict_many(probes), repeat)),
+    }]
+    t0 = time.perf_counter()
+    recognizer.build_ann_index(ann_lists)
+    build_s = time.perf_counter() - t0
+    for nprobe in nprobes:
+        recognizer.ann_nprobe = nprobe
+        got = [label for label, _ in recognizer.predict_many(probes)]
+        rows.append({
+            "stage": "predict_ann",
+            "users": n_users,
+            "gallery_size": gallery_size,
+            "probes": len(probes),
+            "ann_lists": len(recognizer.ivf[0]),
+            "nprobe": nprobe,
+            "build_s": round(build_s, 3),
+            "recall_at_1": round(sum(a == e for a, e in zip(got, exact)) / len(probes), 3),
+            "accuracy": round(sum(a == t for a, t in zip(got, truth)) / len(probes), 3),
+            **_summary(_time(lambda: recognizer.predict_many(probes), repeat)),
+        })
+    recognizer.ivf = None
+    recognizer._index = None
+    return rows
+
+
+def run(user_counts, face_counts, samples_per_user=3, repeat=20, seed=0, engine="lbph",
+        ann_lists=0, nprobes=(1, 2, 4, 8)):
+    import cv2
+    import numpy as np
+    import db
+    import attendance
+    from attendance_writer import AttendanceWriter
+    from detection import detect_faces
+    from sample_store import SAMPLE_SIZE
+    from lbp_recognizer import create_recognizer
+
+    db.init_db()
+    face_cascade = cv2.CascadeClassifier(attendance.CASCADE_PATH)
+    bases = _load_base_crops(cv2, np, SAMPLE_SIZE)
+    rng = np.random.default_rng(seed)
+    results = []
+
+    # A per-run prefix never collides with (and so never overwrites) real users
+    prefix = f"bench{time.strftime('%Y%m%d%H%M%S')}_"
+    created = set()
+    writers = []
+    try:
+        for n_users in user_counts:
+            # Gallery: n_users synthetic identities x samples_per_user
+            faces, labels = [], []
+            for u in range(n_users):
+                base = bases[u % len(bases)]
+                for s in range(samples_per_user):
+                    faces.append(_synthetic_face(cv2, np, base, seed + u * 1000 + s))
+                    labels.append(u)
+            for u in range(n_users):
+                created.add(f"{prefix}{u}")
+                db.add_user(f"{prefix}{u}", f"Bench User {u}", f"{prefix}{u}@example.com")
+            recognizer = create_recognizer(engine)
+            t0 = time.perf_counter()
+            recognizer.train(faces, np.array(labels))
+            train_s = time.perf_counter() - t0
+            attendance._load_user_directory()
+
+            for k in face_counts:
+                query_users = [int(rng.integers(0, n_users)) for _ in range(k)]
+                query = [_synthetic_face(cv2, np, bases[u % len(bases)], seed + 10**7 + u) for u in query_users]
+                frame, boxes = _make_frame(cv2, np, query, rng)
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                crops = [gray[y:y+h, x:x+w] for (x, y, w, h) in boxes]
+                uids = [f"{prefix}{u}" for u in query_users]
+                writer = AttendanceWriter(flush_interval=0.05).start()
+                writers.append(writer)
+
+                stages = {
+                    "cvtColor": lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
+                    "detect": lambda: detect_faces(face_cascade, gray),
+                    "predict": lambda: [recognizer.predict(c) for c in crops],
+                    "predict_batch": lambda: attendance._predict_faces(recognizer, crops),
+                    "user_lookup_db": lambda: [db.get_user_by_userid(u) for u in uids],
+                    "user_lookup_cache": lambda: [attendance._lookup_user(u) for u in uids],
+                    "add_attendance_sync": lambda: [db.add_attendance(u) for u in uids],
+                    "add_attendance_queued": lambda: [writer.submit(u) for u in uids],
+                }
+                detected = len(detect_faces(face_cascade, gray))
+                correct = sum(1 for c, u in zip(crops, query_users) if recognizer.predict(c)[0] == u)
+                for stage, fn in stages.items():
+                    fn()  # warm-up
+                    results.append({
+                        "stage": stage,
+                        "users": n_users,
+                        "gallery_size": len(faces),
+                        "faces_per_frame": k,
+                        **_summary(_time(fn, repeat)),
+                    })
+                writer.close()
+                results.append({
+                    "stage": "summary",
+                    "users": n_users,
+                    "gallery_size": len(faces),
+                    "faces_per_frame": k,
+                    "train_s": round(train_s, 3),
+                    "faces_detected": detected,
+                    "top1_correct": correct,
+                })
+                print(f"[INFO] users={n_users} faces={k}: " + ", ".join(
+                    f"{r['stage']} {r['median_ms']}ms" for r in results
+                    if r.get("users") == n_users and r.get("faces_per_frame") == k and "median_ms" in r),
+                    file=sys.stderr)
+            if ann_lists and hasattr(recognizer, "build_ann_index"):
+                ann_rows = _bench_ann(cv2, np, recognizer, bases, n_users, len(faces), ann_lists, nprobes,
+                                      repeat, seed, rng)
+                results.extend(ann_rows)
+                print(f"[INFO] users={n_users} ann: " + ", ".join(
+                    f"{r.get('nprobe', 'exact')} {r['median_ms']}ms recall {r.get('recall_at_1', 1.0)}"
+                    for r in ann_rows), file=sys.stderr)
+    finally:
+        for writer in writers:
+            writer.close()  # flush queued rows first so none land after the cleanup
+        if created:
+            db.delete_users(sorted(created))
+            print(f"[INFO] Removed {len(created)} benchmark users and their attendance rows", file=sys.stderr)
+    return results
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the recognition pipeline.")
+    parser.add_argument("--users", type=_int_list, default=[1, 10, 100, 1000])
+    parser.add_argument("--faces", type=_int_list, default=[1, 4])
+    parser.add_argument("--samples", type=int, default=3, help="gallery samples per synthetic user")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--use-configured-db", action="store_true")
+    parser.add_argument("--engine", choices=["lbph", "numpy"], default="lbph", help="recognizer engine to benchmark")
+    parser.add_argument("--ann-lists", type=int, default=0, help="numpy engine: also benchmark an ANN index with this many lists")
+    parser.add_argument("--nprobe", type=_int_list, default=[1, 2, 4, 8], help="ANN lists probed per query")
+    args = parser.parse_args()
+
+    tmp_db = _configure_db(args.use_configured_db)
+    try:
+        import cv2
+        report = {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+            "samples_per_user": args.samples,
+            "engine": args.engine,
+            "results": run(args.users, args.faces, args.samples, args.repeat, args.seed, args.engine,
+                           args.ann_lists, args.nprobe),
+        }
+    finally:
+        if tmp_db:
+            os.remove(tmp_db)
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
@@ -2,14 +2,27 @@
 """
 Database helper for Face Recognition Attendance System.
 Uses mysql-connector-python.
+
+The backend (MySQL or SQLite) is decided once, on first use. Once MySQL has been
+chosen it stays chosen: a connection error drops the pool, and the next call
+rebuilds it (or raises while the server is still down) instead of switching to
+SQLite. MySQL connections come from a pool; SQLite connections are kept open per
+thread and reused.
 """
 
+from contextlib import contextmanager
 from datetime import datetime
+import base64
+import functools
 import os
+import threading
+
+from metrics import DB_SECONDS, ATTENDANCE_ROWS_WRITTEN
 
 # Try to use MySQL if available; otherwise fall back to SQLite for local/dev runs.
 USE_SQLITE = os.environ.get("DB_USE_SQLITE", "false").lower() in ("1", "true", "yes")
 SQLITE_FILE = os.environ.get("DB_SQLITE_FILE", "face_attendance.sqlite3")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
 
 DB_CONFIG = {
     "host": os.environ.get("DB_HOST", "localhost"),
@@ -21,39 +34,175 @@ DB_CONFIG = {
 
 # Lazy import of mysql.connector so the module can still be used without it.
 mysql = None
+PoolError = None
+MySQLConnectivityErrors = ()  # errors that mean the server went away, not a bad query
 try:
     if not USE_SQLITE:
         import mysql.connector as mysql_connector
-        from mysql.connector import Error as MySQLError
+        from mysql.connector import pooling as mysql_pooling
+        from mysql.connector.errors import PoolError, InterfaceError, OperationalError
+        MySQLConnectivityErrors = (InterfaceError, OperationalError)
         mysql = mysql_connector
 except Exception:
     mysql = None
 
 import sqlite3
 
+# Cached backend decision: None = not probed yet, True = MySQL, False = SQLite.
+_backend_is_mysql = None
+_backend_lock = threading.Lock()
+_mysql_pool = None
+_sqlite_local = threading.local()
+
+# Bumped by every write to the users table so in-memory caches know to reload.
+_users_version = 0
+
+
+def _create_mysql_pool():
+    """Create the MySQL connection pool. Raises if the server is unreachable."""
+    return mysql_pooling.MySQLConnectionPool(
+        pool_name="face_attendance",
+        pool_size=DB_POOL_SIZE,
+        pool_reset_session=True,
+        **DB_CONFIG
+    )
+
+
+def _timed(op):
+    """Record the wrapped helper's latency in db_query_seconds{op=...}."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with DB_SECONDS.time(op=op):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
 
 def _using_mysql_available():
-    if USE_SQLITE:
-        return False
-    if mysql is None:
-        return False
-    # Try a quick connection test
+    """Return True when MySQL is the active backend. Probes only once."""
+    global _backend_is_mysql, _mysql_pool
+    if _backend_is_mysql is not None:
+        return _backend_is_mysql
+    with _backend_lock:
+        if _backend_is_mysql is not None:
+            return _backend_is_mysql
+        if USE_SQLITE or mysql is None:
+            _backend_is_mysql = False
+            return False
+        # Creating the pool opens its connections, which doubles as the reachability test
+        try:
+            _mysql_pool = _create_mysql_pool()
+            _backend_is_mysql = True
+        except Exception:
+            _mysql_pool = None
+            _backend_is_mysql = False
+        return _backend_is_mysql
+
+
+def _invalidate_pool(error):
+    """Drop the MySQL pool after a connectivity error; the next call rebuilds it."""
+    global _mysql_pool
+    with _backend_lock:
+        if _mysql_pool is not None:
+            print(f"[ERROR] MySQL connection lost; reconnecting on next use: {error}")
+        _mysql_pool = None
+
+
+def _sqlite_connect():
+    conn = sqlite3.connect(SQLITE_FILE, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _mysql_pooled_connection():
+    """Borrow a pooled connection, rebuilding the pool if it was dropped. Raises while MySQL is down."""
+    global _mysql_pool
+    pool = _mysql_pool
+    if pool is None:
+        with _backend_lock:
+            if _mysql_pool is None:
+                _mysql_pool = _create_mysql_pool()
+                print("[INFO] MySQL connection pool re-established")
+            pool = _mysql_pool
     try:
-        conn = mysql.connect(**DB_CONFIG)
-        conn.close()
-        return True
-    except Exception:
-        return False
+        return pool.get_connection()
+    except PoolError:
+        # Pool exhausted: hand out an unpooled connection rather than failing
+        return mysql.connect(**DB_CONFIG)
+
+
+def _sqlite_thread_connection():
+    """Return this thread's reusable SQLite connection."""
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is None:
+        conn = _sqlite_connect()
+        _sqlite_local.conn = conn
+    return conn
+
+
+@contextmanager
+def _connection():
+    """
+    Borrow a connection for one unit of work. Yields (conn, is_mysql).
+    MySQL connections go back to the pool on exit; the SQLite connection stays
+    open for the thread. A MySQL connectivity error drops the pool so the next
+    call reconnects; query errors (integrity, syntax) leave the pool alone.
+    """
+    is_mysql = _using_mysql_available()
+    try:
+        conn = _mysql_pooled_connection() if is_mysql else _sqlite_thread_connection()
+    except Exception as e:
+        if is_mysql and isinstance(e, MySQLConnectivityErrors):
+            _invalidate_pool(e)
+        raise
+    try:
+        yield conn, is_mysql
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        if is_mysql and isinstance(e, MySQLConnectivityErrors):
+            _invalidate_pool(e)
+        raise
+    finally:
+        if is_mysql:
+            conn.close()
 
 
 def get_connection():
-    """Return a DB connection. Use MySQL when available; otherwise use SQLite."""
+    """
+    Return a DB connection owned by the caller. Use MySQL when available;
+    otherwise use SQLite. For MySQL, close() returns it to the pool.
+    """
     if _using_mysql_available():
-        return mysql.connect(**DB_CONFIG)
+        return _mysql_pooled_connection()
     # SQLite fallback
-    conn = sqlite3.connect(SQLITE_FILE, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return _sqlite_connect()
+
+
+# Composite indexes backing fetch_attendance_page: newest-first listing, and the
+# same ordering within a user or status filter. id is the keyset tie-breaker.
+ATTENDANCE_INDEXES = {
+    "idx_attendance_time_id": "login_time, id",
+    "idx_attendance_user_time_id": "user_id, login_time, id",
+    "idx_attendance_status_time_id": "status, login_time, id",
+}
+
+
+def _create_attendance_indexes(cursor, is_mysql):
+    for name, columns in ATTENDANCE_INDEXES.items():
+        if not is_mysql:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON attendance ({columns})")
+            continue
+        # MySQL has no CREATE INDEX IF NOT EXISTS
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'attendance' AND index_name = %s
+        """, (name,))
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"CREATE INDEX {name} ON attendance ({columns})")
 
 
 def init_db():
@@ -68,70 +217,161 @@ def init_db():
         cursor.close()
         conn.close()
 
-        conn = get_connection()
+        with _connection() as (conn, _):
+            cursor = conn.cursor()
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id VARCHAR(50) UNIQUE NOT NULL,
+                name VARCHAR(255) NOT NULL,
+                email VARCHAR(255) NOT NULL,
+                registered_on DATETIME NOT NULL
+            )""")
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS attendance (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id VARCHAR(50) NOT NULL,
+                login_time DATETIME NOT NULL,
+                status VARCHAR(50)
+            )""")
+            _create_attendance_indexes(cursor, True)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS attendance_daily (
+                user_id VARCHAR(50) NOT NULL,
+                day DATE NOT NULL,
+                first_seen DATETIME NOT NULL,
+                last_seen DATETIME NOT NULL,
+                event_count INT NOT NULL,
+                PRIMARY KEY (user_id, day),
+                INDEX idx_attendance_daily_day (day)
+            )""")
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                recipient VARCHAR(255) NOT NULL,
+                kind VARCHAR(20) NOT NULL,
+                user_id VARCHAR(50),
+                name VARCHAR(255),
+                event_time DATETIME,
+                subject VARCHAR(255),
+                body TEXT,
+                status VARCHAR(10) NOT NULL DEFAULT 'pending',
+                attempts INT NOT NULL DEFAULT 0,
+                next_attempt_at DATETIME NOT NULL,
+                last_error VARCHAR(500),
+                created_at DATETIME NOT NULL,
+                sent_at DATETIME,
+                INDEX idx_email_outbox_due (status, next_attempt_at)
+            )""")
+            conn.commit()
+            cursor.close()
+        _backfill_rollup_if_empty()
+        return
+
+    # SQLite path
+    with _connection() as (conn, _):
         cursor = conn.cursor()
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id VARCHAR(50) UNIQUE NOT NULL,
-            name VARCHAR(255) NOT NULL,
-            email VARCHAR(255) NOT NULL,
-            registered_on DATETIME NOT NULL
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            registered_on TEXT NOT NULL
         )""")
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS attendance (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id VARCHAR(50) NOT NULL,
-            login_time DATETIME NOT NULL,
-            status VARCHAR(50)
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            login_time TEXT NOT NULL,
+            status TEXT
+        )""")
+        _create_attendance_indexes(cursor, False)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            event_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
         )""")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_daily_day ON attendance_daily (day)")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            user_id TEXT,
+            name TEXT,
+            event_time TEXT,
+            subject TEXT,
+            body TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )""")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)")
         conn.commit()
         cursor.close()
-        conn.close()
-        return
-
-    # SQLite path
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT UNIQUE NOT NULL,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL,
-        registered_on TEXT NOT NULL
-    )""")
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS attendance (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        login_time TEXT NOT NULL,
-        status TEXT
-    )""")
-    conn.commit()
-    cursor.close()
-    conn.close()
+    _backfill_rollup_if_empty()
 
 
+@_timed("write")
 def add_user(user_id: str, name: str, email: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-    if _using_mysql_available():
-        cursor.execute("""
-            INSERT INTO users (user_id, name, email, registered_on)
-            VALUES (%s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE name=%s, email=%s
-        """, (user_id, name, email, datetime.now(), name, email))
-    else:
-        # SQLite upsert
-        cursor.execute("""
-            INSERT INTO users (user_id, name, email, registered_on)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET name=excluded.name, email=excluded.email
-        """, (user_id, name, email, datetime.now()))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with _connection() as (conn, is_mysql):
+        cursor = conn.cursor()
+        if is_mysql:
+            cursor.execute("""
+                INSERT INTO users (user_id, name, email, registered_on)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE name=%s, email=%s
+            """, (user_id, name, email, datetime.now(), name, email))
+        else:
+            # SQLite upsert
+            cursor.execute("""
+                INSERT INTO users (user_id, name, email, registered_on)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET name=excluded.name, email=excluded.email
+            """, (user_id, name, email, datetime.now()))
+        conn.commit()
+        cursor.close()
+    _bump_users_version()
+
+
+@_timed("write")
+def delete_users(user_ids, batch=500):
+    """Delete users together with their attendance and daily rollup rows. Returns the number of users removed."""
+    user_ids = list(user_ids)
+    removed = 0
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        cursor = conn.cursor()
+        for i in range(0, len(user_ids), batch):
+            chunk = user_ids[i:i + batch]
+            marks = ", ".join([ph] * len(chunk))
+            cursor.execute(f"DELETE FROM attendance WHERE user_id IN ({marks})", chunk)
+            cursor.execute(f"DELETE FROM attendance_daily WHERE user_id IN ({marks})", chunk)
+            cursor.execute(f"DELETE FROM users WHERE user_id IN ({marks})", chunk)
+            removed += cursor.rowcount
+        conn.commit()
+        cursor.close()
+    _bump_users_version()
+    return removed
+
+
+def _bump_users_version():
+    global _users_version
+    with _backend_lock:
+        _users_version += 1
+
+
+def users_version():
+    """Return the in-process version stamp of the users table."""
+    return _users_version
 
 
 def _row_to_dict(row):
@@ -143,105 +383,488 @@ def _row_to_dict(row):
         return row
 
 
-def get_user_by_userid(user_id: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-    if _using_mysql_available():
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE user_id=%s", (user_id,))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return row
-    else:
-        cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
+@_timed("read")
+def _fetch_one_user(column: str, value):
+    """Return the users row where <column> equals value, or None."""
+    with _connection() as (conn, is_mysql):
+        if is_mysql:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"SELECT * FROM users WHERE {column}=%s", (value,))
+        else:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM users WHERE {column}=?", (value,))
         row = cursor.fetchone()
         cursor.close()
-        conn.close()
         return _row_to_dict(row)
 
 
+def get_user_by_userid(user_id: str):
+    return _fetch_one_user("user_id", user_id)
+
+
 def get_user_by_email(email: str):
     """Return a user row by email or None. Works for both MySQL and SQLite."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    if _using_mysql_available():
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE email=%s", (email,))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return row
-    else:
-        cursor.execute("SELECT * FROM users WHERE email=?", (email,))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return _row_to_dict(row)
+    return _fetch_one_user("email", email)
 
 
 def get_user_by_id_numeric(id_numeric: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    if _using_mysql_available():
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE id=%s", (id_numeric,))
-        row = cursor.fetchone()
+    return _fetch_one_user("id", id_numeric)
+
+
+@_timed("read")
+def fetch_all_users():
+    """Return every users row as a list of dicts."""
+    with _connection() as (conn, is_mysql):
+        if is_mysql:
+            cursor = conn.cursor(dictionary=True)
+        else:
+            cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users")
+        rows = [_row_to_dict(r) for r in cursor.fetchall()]
         cursor.close()
-        conn.close()
-        return row
+        return rows
+
+
+def _rollup_upsert(cursor, is_mysql, events):
+    """
+    Fold (user_id, login_time) events into attendance_daily inside the caller's
+    transaction: one upsert per user per day, whatever the batch size.
+    """
+    days = {}
+    for user_id, login_time in events:
+        key = (user_id, login_time.strftime("%Y-%m-%d"))
+        first, last, count = days.get(key, (login_time, login_time, 0))
+        days[key] = (min(first, login_time), max(last, login_time), count + 1)
+    if is_mysql:
+        cursor.executemany("""
+            INSERT INTO attendance_daily (user_id, day, first_seen, last_seen, event_count)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                first_seen = LEAST(first_seen, VALUES(first_seen)),
+                last_seen = GREATEST(last_seen, VALUES(last_seen)),
+                event_count = event_count + VALUES(event_count)
+        """, [(u, d, f, l, c) for (u, d), (f, l, c) in days.items()])
     else:
-        cursor.execute("SELECT * FROM users WHERE id=?", (id_numeric,))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return _row_to_dict(row)
+        fmt = "%Y-%m-%d %H:%M:%S"
+        cursor.executemany("""
+            INSERT INTO attendance_daily (user_id, day, first_seen, last_seen, event_count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, day) DO UPDATE SET
+                first_seen = MIN(first_seen, excluded.first_seen),
+                last_seen = MAX(last_seen, excluded.last_seen),
+                event_count = event_count + excluded.event_count
+        """, [(u, d, f.strftime(fmt), l.strftime(fmt), c) for (u, d), (f, l, c) in days.items()])
 
 
+@_timed("write")
 def add_attendance(user_id: str, status="Present"):
-    conn = get_connection()
-    cursor = conn.cursor()
-    if _using_mysql_available():
-        cursor.execute("INSERT INTO attendance (user_id, login_time, status) VALUES (%s, %s, %s)",
-                       (user_id, datetime.now(), status))
-    else:
-        cursor.execute("INSERT INTO attendance (user_id, login_time, status) VALUES (?, ?, ?)",
-                       (user_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), status))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    now = datetime.now().replace(microsecond=0)
+    with _connection() as (conn, is_mysql):
+        cursor = conn.cursor()
+        if is_mysql:
+            cursor.execute("INSERT INTO attendance (user_id, login_time, status) VALUES (%s, %s, %s)",
+                           (user_id, now, status))
+        else:
+            cursor.execute("INSERT INTO attendance (user_id, login_time, status) VALUES (?, ?, ?)",
+                           (user_id, now.strftime("%Y-%m-%d %H:%M:%S"), status))
+        _rollup_upsert(cursor, is_mysql, [(user_id, now)])
+        conn.commit()
+        cursor.close()
+    ATTENDANCE_ROWS_WRITTEN.inc()
 
 
-def fetch_attendance(limit=100):
-    conn = get_connection()
-    cursor = conn.cursor()
-    if _using_mysql_available():
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
+@_timed("write")
+def add_attendance_many(events):
+    """
+    Insert many attendance rows in one transaction.
+    events: iterable of (user_id, login_time: datetime, status).
+    """
+    # DATETIME columns keep whole seconds; truncate so raw rows and the rollup agree
+    events = [(uid, t.replace(microsecond=0), st) for uid, t, st in events]
+    if not events:
+        return 0
+    with _connection() as (conn, is_mysql):
+        cursor = conn.cursor()
+        if is_mysql:
+            cursor.executemany("INSERT INTO attendance (user_id, login_time, status) VALUES (%s, %s, %s)",
+                               events)
+        else:
+            cursor.executemany("INSERT INTO attendance (user_id, login_time, status) VALUES (?, ?, ?)",
+                               [(uid, t.strftime("%Y-%m-%d %H:%M:%S"), st) for uid, t, st in events])
+        _rollup_upsert(cursor, is_mysql, [(uid, t) for uid, t, _ in events])
+        conn.commit()
+        cursor.close()
+    ATTENDANCE_ROWS_WRITTEN.inc(len(events))
+    return len(events)
+
+
+def encode_cursor(login_time, row_id):
+    """Opaque keyset cursor for the row after which the next page starts."""
+    if isinstance(login_time, datetime):
+        login_time = login_time.strftime("%Y-%m-%d %H:%M:%S")
+    raw = f"{login_time}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises ValueError for a malformed cursor."""
+    try:
+        login_time, row_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return login_time, int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
+def _attendance_filters(ph, start=None, end=None, user_id=None, status=None):
+    """WHERE clauses + params for the attendance filters; start is inclusive, end exclusive."""
+    clauses, params = [], []
+    if start:
+        clauses.append(f"a.login_time >= {ph}")
+        params.append(str(start))
+    if end:
+        clauses.append(f"a.login_time < {ph}")
+        params.append(str(end))
+    if user_id:
+        clauses.append(f"a.user_id = {ph}")
+        params.append(user_id)
+    if status:
+        clauses.append(f"a.status = {ph}")
+        params.append(status)
+    return clauses, params
+
+
+@_timed("read")
+def fetch_attendance_page(limit=100, cursor=None, start=None, end=None, user_id=None, status=None):
+    """
+    One page of attendance, newest first, using keyset pagination on (login_time, id).
+    start/end: "YYYY-MM-DD[ HH:MM:SS]" bounds (start inclusive, end exclusive).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        clauses, params = _attendance_filters(ph, start, end, user_id, status)
+        if cursor:
+            after_time, after_id = decode_cursor(cursor)
+            # Expanded row comparison so both engines can use the (login_time, id) indexes
+            clauses.append(f"(a.login_time < {ph} OR (a.login_time = {ph} AND a.id < {ph}))")
+            params.extend([after_time, after_time, after_id])
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        sql = f"""
             SELECT a.id, a.user_id, u.name, u.email, a.login_time, a.status
             FROM attendance a
             LEFT JOIN users u ON u.user_id = a.user_id
-            ORDER BY a.login_time DESC
-            LIMIT %s
-        """, (limit,))
-        rows = cursor.fetchall()
+            {where}
+            ORDER BY a.login_time DESC, a.id DESC
+            LIMIT {ph}
+        """
+        params.append(limit + 1)  # one extra row tells us whether another page exists
+        cursor_ = conn.cursor(dictionary=True) if is_mysql else conn.cursor()
+        cursor_.execute(sql, params)
+        rows = [_row_to_dict(r) for r in cursor_.fetchall()]
+        cursor_.close()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["login_time"], last["id"])
+    return rows, next_cursor
+
+
+def fetch_attendance(limit=100):
+    return fetch_attendance_page(limit=limit)[0]
+
+
+def iter_attendance(chunk_size=1000, start=None, end=None, user_id=None, status=None):
+    """
+    Yield every matching attendance row, newest first, fetching chunk_size rows
+    per indexed keyset query, so memory stays flat and no connection is held
+    open between chunks while the consumer (e.g. an HTTP download) is slow.
+    """
+    cursor = None
+    while True:
+        rows, cursor = fetch_attendance_page(limit=chunk_size, cursor=cursor, start=start,
+                                             end=end, user_id=user_id, status=status)
+        yield from rows
+        if cursor is None:
+            return
+
+
+@_timed("write")
+def rebuild_daily_rollup(start=None, end=None):
+    """
+    Compaction job: recompute attendance_daily from raw attendance for the days in
+    [start, end) (everything when both are None). Use after bulk imports or deletes.
+    """
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        day_clauses, raw_clauses, params = [], [], []
+        if start:
+            day_clauses.append(f"day >= {ph}")
+            raw_clauses.append(f"login_time >= {ph}")  # range on login_time uses idx_attendance_time_id
+            params.append(str(start)[:10])
+        if end:
+            day_clauses.append(f"day < {ph}")
+            raw_clauses.append(f"login_time < {ph}")
+            params.append(str(end)[:10])
+        day_where = ("WHERE " + " AND ".join(day_clauses)) if day_clauses else ""
+        raw_where = ("WHERE " + " AND ".join(raw_clauses)) if raw_clauses else ""
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM attendance_daily {day_where}", params)
+        cursor.execute(f"""
+            INSERT INTO attendance_daily (user_id, day, first_seen, last_seen, event_count)
+            SELECT user_id, DATE(login_time), MIN(login_time), MAX(login_time), COUNT(*)
+            FROM attendance {raw_where}
+            GROUP BY user_id, DATE(login_time)
+        """, params)
+        rows = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return rows
+
+
+def _backfill_rollup_if_empty():
+    """Populate attendance_daily once for databases that predate it."""
+    with _connection() as (conn, _):
+        cursor = conn.cursor()
+        # Existence checks stop at the first row instead of counting whole tables
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM attendance_daily LIMIT 1), "
+                       "EXISTS (SELECT 1 FROM attendance LIMIT 1)")
+        has_rollup, has_raw = tuple(cursor.fetchone())
+        cursor.close()
+    if not has_rollup and has_raw:
+        rebuild_daily_rollup()
+
+
+def _daily_filters(ph, start=None, end=None, user_id=None):
+    clauses, params = [], []
+    if start:
+        clauses.append(f"d.day >= {ph}")
+        params.append(str(start)[:10])
+    if end:
+        clauses.append(f"d.day < {ph}")
+        params.append(str(end)[:10])
+    if user_id:
+        clauses.append(f"d.user_id = {ph}")
+        params.append(user_id)
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+@_timed("read")
+def fetch_daily_attendance(start=None, end=None, user_id=None, limit=10000):
+    """
+    First-in / last-out per user per day from the rollup (never the raw table).
+    start inclusive, end exclusive, as "YYYY-MM-DD".
+    """
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        where, params = _daily_filters(ph, start, end, user_id)
+        cursor = conn.cursor(dictionary=True) if is_mysql else conn.cursor()
+        cursor.execute(f"""
+            SELECT d.day, d.user_id, u.name, u.email, d.first_seen, d.last_seen, d.event_count
+            FROM attendance_daily d
+            LEFT JOIN users u ON u.user_id = d.user_id
+            {where}
+            ORDER BY d.day DESC, d.user_id
+            LIMIT {ph}
+        """, params + [limit])
+        rows = [_row_to_dict(r) for r in cursor.fetchall()]
         cursor.close()
-        conn.close()
         return rows
-    else:
-        cursor.execute("""
-            SELECT a.id, a.user_id, u.name, u.email, a.login_time, a.status
-            FROM attendance a
-            LEFT JOIN users u ON u.user_id = a.user_id
-            ORDER BY a.login_time DESC
-            LIMIT ?
-        """, (limit,))
-        rows = cursor.fetchall()
-        # convert sqlite3.Row to dicts
-        result = [dict(r) for r in rows]
+
+
+@_timed("read")
+def fetch_attendance_summary(start=None, end=None, user_id=None):
+    """Per-user totals over a date range from the rollup: days present, events, first/last seen."""
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        where, params = _daily_filters(ph, start, end, user_id)
+        cursor = conn.cursor(dictionary=True) if is_mysql else conn.cursor()
+        cursor.execute(f"""
+            SELECT d.user_id, u.name, u.email, COUNT(*) AS days_present,
+                   SUM(d.event_count) AS event_count,
+                   MIN(d.first_seen) AS first_seen, MAX(d.last_seen) AS last_seen
+            FROM attendance_daily d
+            LEFT JOIN users u ON u.user_id = d.user_id
+            {where}
+            GROUP BY d.user_id, u.name, u.email
+            ORDER BY d.user_id
+        """, params)
+        rows = [_row_to_dict(r) for r in cursor.fetchall()]
         cursor.close()
-        conn.close()
-        return result
+        return rows
+
+
+# ---------------------
+# Email outbox
+# ---------------------
+
+OUTBOX_COLUMNS = ("recipient", "kind", "user_id", "name", "event_time", "subject", "body")
+
+
+def _db_time(value, is_mysql):
+    if value is None or is_mysql:
+        return value
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+@_timed("write")
+def add_outbox_many(messages):
+    """
+    Persist pending notifications in one transaction.
+    messages: iterable of dicts with OUTBOX_COLUMNS keys (missing keys are NULL).
+    """
+    messages = list(messages)
+    if not messages:
+        return 0
+    now = datetime.now().replace(microsecond=0)
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        rows = []
+        for m in messages:
+            values = [m.get(c) for c in OUTBOX_COLUMNS]
+            values[OUTBOX_COLUMNS.index("event_time")] = _db_time(m.get("event_time"), is_mysql)
+            rows.append(values + [_db_time(now, is_mysql), _db_time(now, is_mysql)])
+        cursor = conn.cursor()
+        cursor.executemany(f"""
+            INSERT INTO email_outbox ({", ".join(OUTBOX_COLUMNS)}, next_attempt_at, created_at)
+            VALUES ({", ".join([ph] * (len(OUTBOX_COLUMNS) + 2))})
+        """, rows)
+        conn.commit()
+        cursor.close()
+    return len(messages)
+
+
+def _due_outbox_filters(ph, is_mysql, now, kind=None, exclude_kind=None, events_before=None, recipient=None):
+    # 'sending' rows are due again once their claim lease (next_attempt_at) runs out,
+    # i.e. the process that claimed them died before recording the result
+    clauses = ["status IN ('pending', 'sending')", f"next_attempt_at <= {ph}"]
+    params = [_db_time(now, is_mysql)]
+    if kind:
+        clauses.append(f"kind = {ph}")
+        params.append(kind)
+    if exclude_kind:
+        clauses.append(f"kind <> {ph}")
+        params.append(exclude_kind)
+    if events_before is not None:
+        clauses.append(f"event_time < {ph}")
+        params.append(_db_time(events_before, is_mysql))
+    if recipient is not None:
+        clauses.append(f"recipient = {ph}")
+        params.append(recipient)
+    return " AND ".join(clauses), params
+
+
+@_timed("read")
+def fetch_due_outbox(now=None, kind=None, exclude_kind=None, events_before=None, recipient=None, limit=100):
+    """
+    Outbox rows whose next attempt is due, oldest first (limit=None: all of them).
+    events_before: only rows whose event_time is earlier (digests of finished days).
+    Rows must be claimed with claim_outbox() before they are sent.
+    """
+    now = now or datetime.now()
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        where, params = _due_outbox_filters(ph, is_mysql, now, kind, exclude_kind, events_before, recipient)
+        if limit is not None:
+            params.append(limit)
+        cursor = conn.cursor(dictionary=True) if is_mysql else conn.cursor()
+        cursor.execute(f"""
+            SELECT * FROM email_outbox
+            WHERE {where}
+            ORDER BY next_attempt_at, id
+            {f"LIMIT {ph}" if limit is not None else ""}
+        """, params)
+        rows = [_row_to_dict(r) for r in cursor.fetchall()]
+        cursor.close()
+        return rows
+
+
+@_timed("read")
+def fetch_due_outbox_recipients(now=None, kind=None, events_before=None, limit=100):
+    """Distinct recipients with due rows, so a digest can fetch all of one recipient's rows at once."""
+    now = now or datetime.now()
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        where, params = _due_outbox_filters(ph, is_mysql, now, kind, None, events_before)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT DISTINCT recipient FROM email_outbox WHERE {where} ORDER BY recipient LIMIT {ph}",
+                       params + [limit])
+        recipients = [r[0] for r in cursor.fetchall()]
+        cursor.close()
+        return recipients
+
+
+@_timed("write")
+def claim_outbox(ids, lease_until, now=None):
+    """
+    Atomically take due rows for sending, so concurrent outbox workers (the dashboard,
+    CLI attendance, the pipeline) never send the same row twice. A claimed row is
+    'sending' until lease_until, after which another worker may retry it.
+    Returns the ids this call claimed.
+    """
+    now = now or datetime.now()
+    claimed = []
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        cursor = conn.cursor()
+        for row_id in ids:
+            # The WHERE re-checks due-ness, so only one of several racing workers matches
+            cursor.execute(f"""
+                UPDATE email_outbox SET status = 'sending', next_attempt_at = {ph}
+                WHERE id = {ph} AND status IN ('pending', 'sending') AND next_attempt_at <= {ph}
+            """, (_db_time(lease_until.replace(microsecond=0), is_mysql), row_id, _db_time(now, is_mysql)))
+            if cursor.rowcount == 1:
+                claimed.append(row_id)
+        conn.commit()
+        cursor.close()
+    return claimed
+
+
+@_timed("write")
+def mark_outbox_sent(ids):
+    ids = list(ids)
+    if not ids:
+        return
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        now = _db_time(datetime.now().replace(microsecond=0), is_mysql)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE email_outbox SET status = 'sent', sent_at = {ph}, attempts = attempts + 1
+            WHERE id IN ({", ".join([ph] * len(ids))})
+        """, [now] + ids)
+        conn.commit()
+        cursor.close()
+
+
+@_timed("write")
+def mark_outbox_retry(ids, next_attempt_at, error, give_up=False):
+    """Record a failed attempt: reschedule at next_attempt_at, or mark failed when give_up."""
+    ids = list(ids)
+    if not ids:
+        return
+    with _connection() as (conn, is_mysql):
+        ph = "%s" if is_mysql else "?"
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE email_outbox
+            SET status = {ph}, attempts = attempts + 1, next_attempt_at = {ph}, last_error = {ph}
+            WHERE id IN ({", ".join([ph] * len(ids))})
+        """, ["failed" if give_up else "pending", _db_time(next_attempt_at.replace(microsecond=0), is_mysql),
+              str(error)[:500]] + ids)
+        conn.commit()
+        cursor.close()
+
+
+@_timed("read")
+def outbox_counts():
+    """{status: rows} for the email outbox."""
+    with _connection() as (conn, _):
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status")
+        counts = {status: n for status, n in cursor.fetchall()}
+        cursor.close()
+        return counts
 
 
 if __name__ == "__main__":
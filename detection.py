@@ -0,0 +1,102 @@
+# detection.py
+"""
+Face detection shared by register.py and attendance.py.
+
+The Haar cascade runs on a downscaled copy of the frame (optionally cropped to a
+region of interest such as a doorway) and boxes are mapped back to full
+resolution, so the LBPH crop keeps full detail while detection stays cheap.
+
+Configuration (environment variables):
+- DETECT_WIDTH (detection width in pixels, 0 = full resolution, default 640)
+- DETECT_ROI (region of interest as "x,y,w,h" fractions of the frame, default whole frame)
+- FACE_MIN_SIZE / FACE_MAX_SIZE (face size bounds in full-resolution pixels, 0 = no bound)
+- DETECT_SCALE_FACTOR (default 1.2), DETECT_MIN_NEIGHBORS (default 5)
+"""
+
+import os
+
+_cv2 = None
+
+def _get_cv2():
+    """Import cv2 only when first needed."""
+    global _cv2
+    if _cv2 is None:
+        import cv2
+        _cv2 = cv2
+    return _cv2
+
+
+def _parse_roi(value):
+    if not value:
+        return None
+    x, y, w, h = (float(v) for v in value.split(","))
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < w <= 1 and 0 < h <= 1):
+        raise ValueError(f"DETECT_ROI must be x,y,w,h fractions of the frame, got {value!r}")
+    return (x, y, w, h)
+
+
+class DetectionConfig:
+    """Detection resolution, region of interest and face size bounds."""
+
+    def __init__(self, width=640, roi=None, min_size=40, max_size=0, scale_factor=1.2, min_neighbors=5):
+        self.width = width
+        self.roi = roi  # (x, y, w, h) fractions of the frame, or None for the whole frame
+        self.min_size = min_size
+        self.max_size = max_size
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            width=int(os.environ.get("DETECT_WIDTH", 640)),
+            roi=_parse_roi(os.environ.get("DETECT_ROI", "")),
+            min_size=int(os.environ.get("FACE_MIN_SIZE", 40)),
+            max_size=int(os.environ.get("FACE_MAX_SIZE", 0)),
+            scale_factor=float(os.environ.get("DETECT_SCALE_FACTOR", 1.2)),
+            min_neighbors=int(os.environ.get("DETECT_MIN_NEIGHBORS", 5)),
+        )
+
+    def roi_pixels(self, frame_w, frame_h):
+        """Return the region of interest as integer (x, y, w, h) in frame pixels."""
+        if self.roi is None:
+            return 0, 0, frame_w, frame_h
+        fx, fy, fw, fh = self.roi
+        x, y = int(fx * frame_w), int(fy * frame_h)
+        return x, y, max(1, min(int(fw * frame_w), frame_w - x)), max(1, min(int(fh * frame_h), frame_h - y))
+
+
+DEFAULT_CONFIG = DetectionConfig.from_env()
+
+
+def detect_faces(face_cascade, gray, config=None):
+    """Return face boxes [(x, y, w, h)] in full-resolution coordinates of `gray`."""
+    cv2 = _get_cv2()
+    config = config or DEFAULT_CONFIG
+    frame_h, frame_w = gray.shape[:2]
+    rx, ry, rw, rh = config.roi_pixels(frame_w, frame_h)
+    region = gray[ry:ry+rh, rx:rx+rw]
+
+    scale = 1.0
+    if config.width and rw > config.width:
+        scale = config.width / float(rw)
+        region = cv2.resize(region, (config.width, max(1, int(rh * scale))), interpolation=cv2.INTER_AREA)
+
+    kwargs = {}
+    if config.min_size:
+        side = max(1, int(config.min_size * scale))
+        kwargs["minSize"] = (side, side)
+    if config.max_size:
+        side = max(1, int(config.max_size * scale))
+        kwargs["maxSize"] = (side, side)
+    found = face_cascade.detectMultiScale(region, scaleFactor=config.scale_factor,
+                                          minNeighbors=config.min_neighbors, **kwargs)
+
+    boxes = []
+    for (x, y, w, h) in found:
+        fx = rx + int(round(x / scale))
+        fy = ry + int(round(y / scale))
+        fw = min(int(round(w / scale)), frame_w - fx)
+        fh = min(int(round(h / scale)), frame_h - fy)
+        boxes.append((fx, fy, fw, fh))
+    return boxes
@@ -9,58 +9,425 @@ Required environment variables:
 - SMTP_SERVER (optional, defaults to smtp.gmail.com)
 - SMTP_PORT (optional, defaults to 587)
 
-Usage: set the env vars (or use a `.env` during local dev) and the rest of the
-project can call `send_attendance_email(...)`.
+Delivery (optional environment variables):
+- EMAIL_QUEUE_SIZE (max messages waiting for the delivery worker, default 500)
+- EMAIL_MAX_PER_SECOND (send rate cap, default 2)
+- EMAIL_IDLE_SECONDS (close the SMTP session after this long without mail, default 60)
+- EMAIL_MODE ("immediate" sends one mail per recognition; "digest" sends one
+  mail per recipient per day once the day is over)
+- EMAIL_DIGEST_MANAGERS (comma-separated addresses that get every user's digest)
+- EMAIL_POLL_SECONDS (how often the outbox table is checked, default 5)
+- EMAIL_RETRY_SECONDS / EMAIL_MAX_ATTEMPTS (first retry delay, doubled per
+  attempt up to an hour, and attempts before a message is marked failed; 30 / 8)
+
+Messages go through one background delivery worker that keeps a single
+authenticated SMTP session open, reconnects when the server drops it, and
+spaces sends to EMAIL_MAX_PER_SECOND. The recognition loop calls
+`queue_attendance_email(...)`, which never blocks: the notification is written
+to the email_outbox table (see db.py) and survives restarts and SMTP outages.
+`send_attendance_email(...)` and `send_email(...)` send right away and wait
+for the result. The dashboard, CLI attendance and the pipeline may each run an
+outbox on the same table; rows are claimed before sending, so each goes out once.
 """
 
 import os
+import atexit
+import queue
+import threading
+import time
 import smtplib
+from concurrent.futures import Future
 from email.message import EmailMessage
 
+from datetime import datetime, timedelta
+
+from db import (init_db, add_outbox_many, fetch_due_outbox, fetch_due_outbox_recipients, claim_outbox,
+                mark_outbox_sent, mark_outbox_retry, outbox_counts)
+from metrics import EMAIL_SECONDS, EMAILS_SENT, EMAIL_QUEUE_DEPTH, EMAIL_OUTBOX_PENDING, SMTP_CONNECTS
+
 SMTP_USER = os.environ.get("SMTP_USER")
 SMTP_APP_PASSWORD = os.environ.get("SMTP_APP_PASSWORD")
 SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+EMAIL_QUEUE_SIZE = int(os.environ.get("EMAIL_QUEUE_SIZE", 500))
+EMAIL_MAX_PER_SECOND = float(os.environ.get("EMAIL_MAX_PER_SECOND", 2))
+EMAIL_IDLE_SECONDS = float(os.environ.get("EMAIL_IDLE_SECONDS", 60))
+EMAIL_MODE = os.environ.get("EMAIL_MODE", "immediate").lower()
+EMAIL_DIGEST_MANAGERS = [a.strip() for a in os.environ.get("EMAIL_DIGEST_MANAGERS", "").split(",") if a.strip()]
+EMAIL_POLL_SECONDS = float(os.environ.get("EMAIL_POLL_SECONDS", 5))
+EMAIL_RETRY_SECONDS = float(os.environ.get("EMAIL_RETRY_SECONDS", 30))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", 8))
+RETRY_MAX_SECONDS = 3600
+DUE_BATCH = 50  # outbox rows (or digest recipients) per pass, so direct sends are not stuck behind a backlog
+CLAIM_SECONDS = 600  # a claimed row goes back to other workers if not sent or retried by then
+SEND_TIMEOUT = 60  # how long the synchronous helpers wait for the worker
+
+_STOP = object()
 
 def _smtp_config_valid():
     return bool(SMTP_USER and SMTP_APP_PASSWORD)
 
-def send_attendance_email(to_email: str, name: str, user_id: str, timestamp_str: str):
+
+class SMTPSession:
+    """One authenticated SMTP connection, opened on demand and reopened after a failure."""
+
+    def __init__(self, server=None, port=None, user=None, password=None):
+        self.server = server or SMTP_SERVER
+        self.port = port or SMTP_PORT
+        self.user = user or SMTP_USER
+        self.password = password or SMTP_APP_PASSWORD
+        self._smtp = None
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=30)
+        smtp.ehlo()
+        smtp.starttls()
+        smtp.login(self.user, self.password)
+        SMTP_CONNECTS.inc()
+        self._smtp = smtp
+
+    def send(self, msg):
+        """Send over the open session; on a dropped connection reconnect and retry once."""
+        if self._smtp is None:
+            self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+            # Servers close idle or long-lived sessions; a fresh login usually fixes it
+            self.close()
+            self._connect()
+            self._smtp.send_message(msg)
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+    @property
+    def connected(self):
+        return self._smtp is not None
+
+
+class EmailOutbox:
+    """
+    Outgoing mail drained by one throttled delivery thread.
+    Direct sends (submit) sit in a bounded in-memory queue; attendance
+    notifications (notify) are persisted to the email_outbox table and retried
+    with exponential backoff, or rolled into one digest per recipient per day.
+    """
+
+    def __init__(self, queue_size=EMAIL_QUEUE_SIZE, max_per_second=EMAIL_MAX_PER_SECOND,
+                 idle_seconds=EMAIL_IDLE_SECONDS, session=None, mode=EMAIL_MODE,
+                 poll_seconds=EMAIL_POLL_SECONDS):
+        self.min_interval = 1.0 / max_per_second if max_per_second > 0 else 0.0
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self.mode = mode
+        self.session = session or SMTPSession()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._unsaved = []  # notifications not yet written to the outbox table
+        self._db_ready = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_send = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0  # rejected because the queue was full
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+                self._thread.start()
+        return self
+
+    def _put(self, item, recipients):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            EMAILS_SENT.inc(result="dropped")
+            print(f"[WARN] Email queue full; dropped message to {recipients}")
+            return False
+        return True
+
+    def submit(self, msg):
+        """Queue a message for immediate delivery without blocking. Returns a Future of the result, or None if dropped."""
+        future = Future()
+        return future if self._put(("send", msg, future), msg["To"]) else None
+
+    def notify(self, notifications):
+        """
+        Queue notifications (dicts with db.OUTBOX_COLUMNS keys) to be persisted and
+        delivered by the worker. Never blocks; False if dropped.
+        """
+        notifications = list(notifications)
+        if not notifications:
+            return True
+        return self._put(("notify", notifications), ", ".join(n["recipient"] for n in notifications))
+
+    def queue_depth(self):
+        return self._queue.qsize() + len(self._unsaved)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "queue_depth": self.queue_depth(),
+                "connected": self.session.connected,
+            }
+
+    def close(self, timeout=None):
+        """Persist queued notifications and deliver queued direct sends, then stop the worker."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _throttle(self):
+        wait = self._last_send + self.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_send = time.monotonic()
+
+    def _deliver(self, msg):
+        """Send one message; returns None on success, else the exception."""
+        self._throttle()
+        start = time.perf_counter()
+        try:
+            self.session.send(msg)
+        except Exception as e:
+            EMAIL_SECONDS.observe(time.perf_counter() - start)
+            EMAILS_SENT.inc(result="error")
+            self.session.close()
+            with self._lock:
+                self.failed += 1
+            print("[ERROR] Failed to send email:", e)
+            return e
+        EMAIL_SECONDS.observe(time.perf_counter() - start)
+        EMAILS_SENT.inc(result="ok")
+        with self._lock:
+            self.sent += 1
+        print(f"[INFO] Email sent to {msg['To']}")
+        return None
+
+    def _drain(self):
+        """Wait up to poll_seconds for work, then take everything queued. Returns (items, stop)."""
+        items = []
+        try:
+            items.append(self._queue.get(timeout=self.poll_seconds))
+            while True:
+                items.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        stop = any(item is _STOP for item in items)
+        return [item for item in items if item is not _STOP], stop
+
+    def _ensure_db(self):
+        """Create the outbox table once; retried each pass while the DB is unreachable."""
+        if not self._db_ready:
+            try:
+                init_db()  # creates email_outbox on databases that predate it
+                self._db_ready = True
+            except Exception as e:
+                print(f"[ERROR] Email outbox database unavailable: {e}")
+        return self._db_ready
+
+    def _persist(self):
+        if not self._unsaved:
+            return
+        try:
+            if not self._ensure_db():
+                raise RuntimeError("database unavailable")
+            add_outbox_many(self._unsaved)
+            self._unsaved = []
+        except Exception as e:
+            print(f"[ERROR] Could not persist {len(self._unsaved)} email notifications: {e}")
+            overflow = len(self._unsaved) - self._queue.maxsize
+            if overflow > 0:
+                # the DB has been down a while; keep memory bounded like the queue itself
+                del self._unsaved[:overflow]
+                with self._lock:
+                    self.dropped += overflow
+                EMAILS_SENT.inc(overflow, result="dropped")
+
+    def _retry(self, rows, error):
+        attempts = max(r["attempts"] for r in rows) + 1
+        delay = min(EMAIL_RETRY_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        give_up = attempts >= EMAIL_MAX_ATTEMPTS
+        mark_outbox_retry([r["id"] for r in rows], datetime.now() + timedelta(seconds=delay), error, give_up)
+        if give_up:
+            print(f"[ERROR] Giving up on email to {rows[0]['recipient']} after {attempts} attempts.")
+
+    def _deliver_due(self):
+        """Send outbox rows that are due: one by one, or as per-day digests in digest mode."""
+        if not self._ensure_db():
+            return
+        now = datetime.now()
+        if self.mode == "digest":
+            # Only finished days are digested, so each recipient gets one mail per day
+            midnight = datetime.combine(now.date(), datetime.min.time())
+            for recipient in fetch_due_outbox_recipients(now, kind="attendance", events_before=midnight,
+                                                         limit=DUE_BATCH):
+                self._send_digests(fetch_due_outbox(now, kind="attendance", events_before=midnight,
+                                                    recipient=recipient, limit=None))
+            rows = fetch_due_outbox(now, exclude_kind="attendance", limit=DUE_BATCH)
+        else:
+            rows = fetch_due_outbox(now, limit=DUE_BATCH)
+        for row in rows:
+            # Other processes run outboxes on the same table; send only what this one claimed
+            if not claim_outbox([row["id"]], datetime.now() + timedelta(seconds=CLAIM_SECONDS)):
+                continue
+            error = self._deliver(_outbox_message(row))
+            if error is None:
+                mark_outbox_sent([row["id"]])
+            else:
+                self._retry([row], error)
+
+    def _send_digests(self, rows):
+        """Send one recipient's due rows (all of them, so a day is never split) as one mail per day."""
+        claimed = set(claim_outbox([r["id"] for r in rows], datetime.now() + timedelta(seconds=CLAIM_SECONDS)))
+        groups = {}
+        for row in (r for r in rows if r["id"] in claimed):
+            groups.setdefault((row["recipient"], str(row["event_time"])[:10]), []).append(row)
+        for (recipient, day), group in groups.items():
+            error = self._deliver(_digest_message(recipient, day, group))
+            if error is None:
+                mark_outbox_sent([r["id"] for r in group])
+            else:
+                self._retry(group, error)
+
+    def _run(self):
+        self._ensure_db()
+        try:
+            # rows left pending by an earlier process go out on the first pass
+            self._deliver_due()
+        except Exception as e:
+            print(f"[ERROR] Email outbox pass failed: {e}")
+        try:
+            while True:
+                items, stop = self._drain()
+                for item in items:
+                    if item[0] == "notify":
+                        self._unsaved.extend(item[1])
+                    else:
+                        _, msg, future = item
+                        error = self._deliver(msg)
+                        if not future.done():
+                            future.set_result(error is None)
+                self._persist()
+                if stop:
+                    break  # anything still in the outbox table goes out on the next run
+                try:
+                    self._deliver_due()
+                except Exception as e:
+                    print(f"[ERROR] Email outbox pass failed: {e}")
+                if self.session.connected and time.monotonic() - self._last_send > self.idle_seconds:
+                    self.session.close()  # idle: don't hold a session the server will drop anyway
+        finally:
+            self.session.close()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+EMAIL_QUEUE_DEPTH.set_function(lambda: _outbox.queue_depth() if _outbox is not None else 0)
+EMAIL_OUTBOX_PENDING.set_function(lambda: outbox_counts().get("pending", 0))
+
+def get_outbox():
+    """The process-wide outbox, started on first use."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = EmailOutbox().start()
+            # flush what the recognition loop queued before a CLI run exits
+            atexit.register(_outbox.close, SEND_TIMEOUT)
+        return _outbox
+
+def start_outbox():
+    """
+    Start the outbox worker at application startup so notifications persisted by an
+    earlier process are delivered without waiting for a new one. No-op without SMTP config.
+    """
     if not _smtp_config_valid():
-        print("[WARN] SMTP configuration missing. Email sending disabled. Set SMTP_USER and SMTP_APP_PASSWORD to enable.")
-        return False
+        return None
+    return get_outbox()
+
+def _build_message(to, subject, body):
+    msg = EmailMessage()
+    msg["From"] = SMTP_USER
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg
 
+def _attendance_message(to_email, name, user_id, timestamp_str):
     subject = "Attendance Recorded"
     body = (
         f"Hello {name},\n\nYour attendance has been recorded.\n\n"
         f"User ID: {user_id}\nTime: {timestamp_str}\n\nRegards,\nAttendance System"
     )
+    return _build_message(to_email, subject, body)
 
-    msg = EmailMessage()
-    msg["From"] = SMTP_USER
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.set_content(body)
+def _outbox_message(row):
+    if row["kind"] == "attendance":
+        return _attendance_message(row["recipient"], row["name"], row["user_id"], str(row["event_time"])[:19])
+    return _build_message(row["recipient"], row["subject"], row["body"])
+
+def _digest_message(recipient, day, rows):
+    """One mail covering a day's events for one recipient (a user, or a manager for everyone)."""
+    per_user = {}
+    for r in rows:
+        t = str(r["event_time"])[11:19]
+        first, last, count, name = per_user.get(r["user_id"], (t, t, 0, r["name"]))
+        per_user[r["user_id"]] = (min(first, t), max(last, t), count + 1, name)
+    lines = [f"{name} ({uid}): first seen {first}, last seen {last}, {count} recognition(s)"
+             for uid, (first, last, count, name) in sorted(per_user.items())]
+    body = (
+        f"Hello,\n\nAttendance recorded on {day}:\n\n" + "\n".join(lines) +
+        "\n\nRegards,\nAttendance System"
+    )
+    return _build_message(recipient, f"Attendance Summary for {day}", body)
 
+def _send_and_wait(msg):
+    future = get_outbox().submit(msg)
+    if future is None:
+        return False
     try:
-        smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        smtp.ehlo()
-        smtp.starttls()
-        smtp.login(SMTP_USER, SMTP_APP_PASSWORD)
-        smtp.send_message(msg)
-        smtp.quit()
-        print(f"[INFO] Email sent to {to_email}")
-        return True
-    except Exception as e:
-        print("[ERROR] Failed to send email:", e)
+        return future.result(timeout=SEND_TIMEOUT)
+    except Exception:
         return False
 
-if __name__ == "__main__":
-    # simple local test — ensure env vars are configured first
-    try:
-        send_attendance_email("someone@example.com", "Test User", "u001", "2025-10-27 12:00:00")
-    except Exception as e:
-        print("SMTP config missing or test failed:", e)
+def queue_attendance_email(to_email: str, name: str, user_id: str, timestamp_str: str):
+    """
+    Queue a durable attendance notification (plus manager copies in digest mode).
+    Never blocks; False if not queued.
+    """
+    if not _smtp_config_valid():
+        print("[WARN] SMTP configuration missing. Email sending disabled. Set SMTP_USER and SMTP_APP_PASSWORD to enable.")
+        return False
+    outbox = get_outbox()
+    recipients = [to_email] if to_email else []
+    if outbox.mode == "digest":
+        recipients += [m for m in EMAIL_DIGEST_MANAGERS if m not in recipients]
+    event_time = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+    return outbox.notify({"recipient": r, "kind": "attendance", "user_id": user_id, "name": name,
+                          "event_time": event_time} for r in recipients)
+
+def send_attendance_email(to_email: str, name: str, user_id: str, timestamp_str: str):
+    if not _smtp_config_valid():
+        print("[WARN] SMTP configuration missing. Email sending disabled. Set SMTP_USER and SMTP_APP_PASSWORD to enable.")
+        return False
+    return _send_and_wait(_attendance_message(to_email, name, user_id, timestamp_str))
 
 def send_email(to: str, subject: str, message: str):
     """
@@ -71,22 +438,11 @@ def send_email(to: str, subject: str, message: str):
     if not _smtp_config_valid():
         print("[WARN] SMTP configuration missing. Email sending disabled. Set SMTP_USER and SMTP_APP_PASSWORD to enable.")
         return False
+    return _send_and_wait(_build_message(to, subject, message))
 
-    msg = EmailMessage()
-    msg["From"] = SMTP_USER
-    msg["To"] = to
-    msg["Subject"] = subject
-    msg.set_content(message)
-
+if __name__ == "__main__":
+    # simple local test — ensure env vars are configured first
     try:
-        smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        smtp.ehlo()
-        smtp.starttls()
-        smtp.login(SMTP_USER, SMTP_APP_PASSWORD)
-        smtp.send_message(msg)
-        smtp.quit()
-        print(f"[INFO] Email sent to {to}")
-        return True
+        send_attendance_email("someone@example.com", "Test User", "u001", "2025-10-27 12:00:00")
     except Exception as e:
-        print("[ERROR] Failed to send email:", e)
-        return False
+        print("SMTP config missing or test failed:", e)
@@ -0,0 +1,82 @@
+# events.py
+"""
+In-process fan-out of live events (attendance check-ins) to Server-Sent Events clients.
+
+Each subscriber gets its own bounded buffer; a slow client loses its oldest
+events instead of blocking the publisher or growing memory.
+"""
+
+import os
+import queue
+import threading
+
+from metrics import SSE_CLIENTS
+
+SUBSCRIBER_BUFFER = int(os.environ.get("SSE_CLIENT_BUFFER", 100))
+
+
+class Subscription:
+    def __init__(self, broadcaster, maxsize):
+        self._broadcaster = broadcaster
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def _offer(self, event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                # Make room by discarding the oldest event for this client only
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next event, or None after `timeout` seconds without one."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    def __init__(self, buffer_size=SUBSCRIBER_BUFFER):
+        self.buffer_size = buffer_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, limit=None):
+        """A new Subscription, or None if `limit` subscribers are already connected."""
+        sub = Subscription(self, self.buffer_size)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for sub in subscribers:
+            sub._offer(event)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+# Attendance rows as they are written by attendance_writer.AttendanceWriter
+attendance_events = Broadcaster()
+SSE_CLIENTS.set_function(attendance_events.subscriber_count)
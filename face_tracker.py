@@ -0,0 +1,139 @@
+# face_tracker.py
+"""
+Lightweight IoU face tracker so a person standing at the camera is recognized
+once instead of on every frame.
+
+Each detection is associated with a track by box overlap. A track runs LBPH on
+every frame until a majority of its recent predictions agree (identity voting),
+then only re-verifies every TRACK_REVERIFY_FRAMES frames, or starts voting again
+as soon as a re-verification disagrees or falls above the threshold.
+Counts are in processed frames, not seconds, so replays are deterministic.
+
+Configuration (environment variables):
+- TRACK_IOU_MIN (overlap needed to continue a track, default 0.3)
+- TRACK_MAX_MISSES (frames a track survives without a detection, default 10)
+- TRACK_VOTES (predictions needed before a track's identity is trusted, default 3)
+- TRACK_VOTE_WINDOW (recent predictions kept for voting, default 5)
+- TRACK_REVERIFY_FRAMES (frames between re-verifications of a stable track, default 15)
+"""
+
+import os
+import threading
+from collections import Counter, deque
+
+TRACK_IOU_MIN = float(os.environ.get("TRACK_IOU_MIN", 0.3))
+TRACK_MAX_MISSES = int(os.environ.get("TRACK_MAX_MISSES", 10))
+TRACK_VOTES = int(os.environ.get("TRACK_VOTES", 3))
+TRACK_VOTE_WINDOW = int(os.environ.get("TRACK_VOTE_WINDOW", 5))
+TRACK_REVERIFY_FRAMES = int(os.environ.get("TRACK_REVERIFY_FRAMES", 15))
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """One face followed across frames, with its identity votes."""
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.misses = 0
+        self.votes = deque(maxlen=TRACK_VOTE_WINDOW)  # (label or None for unknown, confidence)
+        self.label = None
+        self.confidence = None
+        self.stable = False
+        self.since_verify = 0
+
+    def needs_prediction(self):
+        return not self.stable or self.since_verify >= TRACK_REVERIFY_FRAMES
+
+    def observe(self, label, confidence, threshold):
+        """Record one recognizer.predict result for this track."""
+        self.since_verify = 0
+        vote = label if confidence < threshold else None
+        if self.stable:
+            if vote == self.label:
+                self.confidence = confidence
+                return
+            # Re-verification disagreed or confidence dropped: vote again from scratch
+            self.stable = False
+            self.votes.clear()
+        self.votes.append((vote, confidence))
+        if len(self.votes) < TRACK_VOTES:
+            return
+        winner, count = Counter(v for v, _ in self.votes).most_common(1)[0]
+        if count * 2 > len(self.votes):
+            confs = [c for v, c in self.votes if v == winner]
+            self.label = winner
+            self.confidence = sum(confs) / len(confs)
+            self.stable = True
+
+
+class FaceTracker:
+    """Associates each frame's detections with tracks by greedy IoU matching."""
+
+    def __init__(self, iou_min=TRACK_IOU_MIN, max_misses=TRACK_MAX_MISSES):
+        self.iou_min = iou_min
+        self.max_misses = max_misses
+        self.tracks = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.predictions = 0
+        self.detections = 0
+
+    def update(self, boxes):
+        """Return [(track, box)] in detection order, creating and expiring tracks as needed."""
+        boxes = [tuple(int(v) for v in b) for b in boxes]
+        with self._lock:
+            pairs = sorted(((iou(t.box, b), ti, bi) for ti, t in enumerate(self.tracks)
+                            for bi, b in enumerate(boxes)), reverse=True)
+            track_for_box = {}
+            used_tracks = set()
+            for overlap, ti, bi in pairs:
+                if overlap < self.iou_min:
+                    break
+                if ti in used_tracks or bi in track_for_box:
+                    continue
+                used_tracks.add(ti)
+                track_for_box[bi] = self.tracks[ti]
+            for ti, t in enumerate(self.tracks):
+                if ti not in used_tracks:
+                    t.misses += 1
+            self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+            out = []
+            for bi, box in enumerate(boxes):
+                track = track_for_box.get(bi)
+                if track is None:
+                    track = Track(self._next_id, box)
+                    self._next_id += 1
+                    self.tracks.append(track)
+                else:
+                    track.box = box
+                    track.misses = 0
+                    track.since_verify += 1
+                out.append((track, box))
+            self.detections += len(boxes)
+            return out
+
+    def observe(self, track, label, confidence, threshold):
+        """Feed a prediction to a track (counted, for the predictions-saved stat)."""
+        with self._lock:
+            self.predictions += 1
+            track.observe(label, confidence, threshold)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active_tracks": len(self.tracks),
+                "tracks_started": self._next_id - 1,
+                "detections": self.detections,
+                "predictions": self.predictions,
+            }
@@ -12,7 +12,10 @@ Open http://127.0.0.1:5000 in your browser
 NOTE: This file tries to be defensive: if a backend module or function is missing it will return helpful errors
 """
 
-from flask import Flask, request, jsonify, render_template_string, send_file
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
+import json
+import zlib
+import itertools
 import threading
 import traceback
 import io
@@ -36,11 +39,39 @@ except Exception as e:
     start_attendance = None
 
 try:
-    from db import fetch_attendance, init_db
+    from attendance import recognize_images, decode_image
+except Exception as e:
+    recognize_images = None
+    decode_image = None
+
+try:
+    from db import fetch_attendance, fetch_attendance_page, iter_attendance, init_db
 except Exception as e:
     fetch_attendance = None
+    fetch_attendance_page = None
+    iter_attendance = None
     init_db = None
 
+try:
+    from db import fetch_daily_attendance, fetch_attendance_summary, rebuild_daily_rollup
+except Exception as e:
+    fetch_daily_attendance = None
+    fetch_attendance_summary = None
+    rebuild_daily_rollup = None
+
+try:
+    from model_cache import model_status
+except Exception:
+    model_status = None
+
+try:
+    import metrics
+except Exception:
+    metrics = None
+
+from jobs import JobManager, JobConflict
+from events import attendance_events
+
 # Optional email notifier
 try:
     import email_notifier
@@ -52,6 +83,28 @@ except Exception:
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 
+# train/attend/register run here instead of inside the request
+job_manager = JobManager()
+
+# /api/recognize admission: RECOGNIZE_WORKERS requests run at once, up to
+# RECOGNIZE_QUEUE_SIZE more wait, anything beyond that gets 429
+RECOGNIZE_WORKERS = int(os.environ.get('RECOGNIZE_WORKERS', 2))
+RECOGNIZE_QUEUE_SIZE = int(os.environ.get('RECOGNIZE_QUEUE_SIZE', 8))
+RECOGNIZE_MAX_IMAGES = int(os.environ.get('RECOGNIZE_MAX_IMAGES', 16))
+_recognize_admission = threading.BoundedSemaphore(RECOGNIZE_WORKERS + RECOGNIZE_QUEUE_SIZE)
+_recognize_workers = threading.BoundedSemaphore(RECOGNIZE_WORKERS)
+
+# Deliver email notifications left pending by a previous process
+if email_notifier is not None:
+    try:
+        email_notifier.start_outbox()
+    except Exception as e:
+        print(f"[WARN] Email outbox not started: {e}")
+
+# Each open /api/attendance/stream holds one server thread for as long as the tab
+# is open; keep this well below gunicorn's --threads so other requests still run
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 4))
+
 # Defer DB initialization until first request (speeds up app startup)
 _db_initialized = False
 
@@ -153,7 +206,7 @@ HTML = r'''<!doctype html>
       <div>
         <div class="card">
           <h3>View attendance</h3>
-          <p class="muted">Recent attendance records.</p>
+          <p class="muted">Recent attendance records. <span id="liveStatus"></span></p>
           <div id="attendanceTable" style="max-height:420px;overflow:auto">
             <div class="muted">Loading...</div>
           </div>
@@ -195,43 +248,57 @@ async function jsonPost(url, body){
   }
 }
 
+// Poll /api/jobs/<id> until the job finishes, showing progress in `status`
+async function pollJob(jobId, status, label, onDone){
+  while(true){
+    let data;
+    try{
+      const res = await fetch('/api/jobs/' + jobId);
+      data = await res.json();
+    }catch(e){ data = {ok:false, error: e.toString()} }
+    if(!data.ok){ status.innerHTML = '❌ ' + (data.error || 'Job lookup failed'); return; }
+    const job = data.job;
+    if(job.status === 'succeeded'){
+      status.innerHTML = '✅ ' + (job.result || label + ' complete') + ' (' + job.duration_s + 's)';
+      if(onDone) onDone(job);
+      return;
+    }
+    if(job.status === 'failed'){ status.innerHTML = '❌ ' + (job.error || label + ' failed'); return; }
+    const pct = job.progress != null ? ' ' + Math.round(job.progress * 100) + '%' : '';
+    const msg = job.message ? ' — ' + job.message : '';
+    status.innerHTML = '<span class="spinner"></span> ' + (job.status === 'queued' ? 'Queued' : label) + pct + msg;
+    await new Promise(r => setTimeout(r, 1000));
+  }
+}
+
+// Start a job via POST and poll it; a 409 conflict still returns the running job's id
+async function startJob(url, body, status, label, onDone){
+  status.innerHTML = '<span class="spinner"></span> Submitting...';
+  const resp = await jsonPost(url, body);
+  if(resp && resp.job_id){
+    if(!resp.ok && resp.error){ status.innerHTML = '<span class="spinner"></span> ' + resp.error; }
+    return pollJob(resp.job_id, status, label, onDone);
+  }
+  status.innerHTML = '❌ ' + (resp && resp.error ? resp.error : label + ' failed');
+}
+
 async function registerUser(){
   const user_id = document.getElementById('user_id').value.trim();
   const name = document.getElementById('name').value.trim();
   const email = document.getElementById('email').value.trim();
   const samples = Number(document.getElementById('samples').value) || 30;
   const status = document.getElementById('regStatus');
-  status.innerHTML = '<span class="spinner"></span> Registering...';
-  const resp = await jsonPost('/api/register', {user_id, name, email, samples});
-  if(resp && resp.ok){
-    status.innerHTML = '✅ ' + resp.message;
-    refreshAttendance();
-  } else {
-    status.innerHTML = '❌ ' + (resp && resp.error ? resp.error : 'Unknown error');
-  }
+  await startJob('/api/register', {user_id, name, email, samples}, status, 'Registering');
 }
 
 async function trainModel(){
   const status = document.getElementById('trainStatus');
-  status.innerHTML = '<span class="spinner"></span> Training...';
-  const resp = await jsonPost('/api/train', {});
-  if(resp && resp.ok){
-    status.innerHTML = '✅ ' + resp.message;
-  } else {
-    status.innerHTML = '❌ ' + (resp && resp.error ? resp.error : 'Training failed');
-  }
+  await startJob('/api/train', {}, status, 'Training');
 }
 
 async function takeAttendance(){
   const status = document.getElementById('attStatus');
-  status.innerHTML = '<span class="spinner"></span> Running...';
-  const resp = await jsonPost('/api/attend', {});
-  if(resp && resp.ok){
-    status.innerHTML = '✅ ' + resp.message;
-    refreshAttendance();
-  } else {
-    status.innerHTML = '❌ ' + (resp && resp.error ? resp.error : 'Failed');
-  }
+  await startJob('/api/attend', {}, status, 'Running');
 }
 
 async function refreshAttendance(){
@@ -243,13 +310,48 @@ async function refreshAttendance(){
     if(!data.ok){ container.innerHTML = '<div class="muted">Error: '+ (data.error||'unknown') +'</div>'; return; }
     const rows = data.rows || [];
     if(rows.length === 0){ container.innerHTML = '<div class="muted">No attendance yet</div>'; return; }
-    let html = '<table><thead><tr><th>ID</th><th>Name</th><th>Email</th><th>Time</th><th>Note</th></tr></thead><tbody>';
-    for(const r of rows){ html += `<tr><td>${r.id||''}</td><td>${r.name||''}</td><td>${r.email||''}</td><td>${r.time||''}</td><td>${r.note||''}</td></tr>` }
+    let html = '<table><thead><tr><th>ID</th><th>Name</th><th>Email</th><th>Time</th><th>Note</th></tr></thead><tbody id="attendanceRows">';
+    for(const r of rows){ html += attendanceRow(r) }
     html += '</tbody></table>';
     container.innerHTML = html;
   }catch(e){ container.innerHTML = '<div class="muted">Fetch error</div>' }
 }
 
+function escapeHtml(v){
+  return String(v == null ? '' : v).replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c]));
+}
+
+function attendanceRow(r){
+  const note = (r.status || r.note || '') + (r.confidence != null ? ' (' + r.confidence + ')' : '');
+  return `<tr><td>${escapeHtml(r.id || r.user_id)}</td><td>${escapeHtml(r.name)}</td><td>${escapeHtml(r.email)}</td><td>${escapeHtml(r.login_time || r.time)}</td><td>${escapeHtml(note)}</td></tr>`;
+}
+
+// Live attendance: insert each pushed row at the top instead of re-fetching the table
+function startLiveAttendance(){
+  if(!window.EventSource) return;
+  const live = document.getElementById('liveStatus');
+  const source = new EventSource('/api/attendance/stream');
+  source.onopen = () => { live.textContent = '● live'; };
+  source.onerror = () => {
+    if(source.readyState === EventSource.CLOSED){
+      // refused (e.g. 503 when the server's stream limit is reached): retry later ourselves
+      live.textContent = '○ live updates busy';
+      setTimeout(startLiveAttendance, 30000);
+    } else {
+      live.textContent = '○ reconnecting';
+    }
+  };
+  source.onmessage = (ev) => {
+    const r = JSON.parse(ev.data);
+    let body = document.getElementById('attendanceRows');
+    if(!body){
+      document.getElementById('attendanceTable').innerHTML = '<table><thead><tr><th>ID</th><th>Name</th><th>Email</th><th>Time</th><th>Note</th></tr></thead><tbody id="attendanceRows"></tbody></table>';
+      body = document.getElementById('attendanceRows');
+    }
+    body.insertAdjacentHTML('afterbegin', attendanceRow(r));
+  };
+}
+
 async function downloadCSV(){
   window.location = '/api/attendance.csv';
 }
@@ -264,8 +366,9 @@ async function sendEmail(){
   if(resp && resp.ok){ status.innerHTML = '✅ ' + resp.message } else { status.innerHTML = '❌ ' + (resp && resp.error ? resp.error : 'Failed') }
 }
 
-// load attendance on open
+// load attendance on open, then follow live updates
 refreshAttendance();
+startLiveAttendance();
 </script>
 </body>
 </html>
@@ -275,14 +378,31 @@ refreshAttendance();
 # Helper functions
 # ---------------------
 
-def run_and_capture(func, *a, **kw):
-    """Run a backend function and capture exception to return a dict."""
+def submit_job(kind, func, *a, key=None, **kw):
+    """Queue a backend function as a background job; returns (response, status code)."""
     try:
-        result = func(*a, **kw)
-        return {'ok': True, 'result': result}
-    except Exception as e:
-        tb = traceback.format_exc()
-        return {'ok': False, 'error': str(e), 'traceback': tb}
+        job = job_manager.submit(kind, func, *a, key=key, **kw)
+    except JobConflict as e:
+        return jsonify(ok=False, error=str(e), job_id=e.job.id, job=e.job.to_dict()), 409
+    return jsonify(ok=True, job_id=job.id, job=job.to_dict(), message=f'{kind} job queued'), 202
+
+def _register_job(user_id, name, email, samples, progress=None):
+    count = register_user(user_id, name, email, samples, progress=progress)
+    return f'Captured {count} samples for {name}'
+
+def _train_job(progress=None):
+    train_model(progress=progress)
+    return 'Training finished'
+
+def _attend_job(progress=None):
+    if progress:
+        progress(None, 'Camera running on the server')
+    start_attendance()
+    return 'Attendance run complete'
+
+def _rollup_job(start=None, end=None, progress=None):
+    rows = rebuild_daily_rollup(start, end)
+    return f'Rebuilt {rows} daily rollup rows.'
 
 # ---------------------
 # Routes
@@ -303,40 +423,51 @@ def api_register():
     samples = data.get('samples', 30)
     if not user_id or not name:
         return jsonify(ok=False, error='user_id and name are required')
-    # call register_user synchronously and return feedback
-    out = run_and_capture(register_user, user_id, name, email, samples)
-    if out['ok']:
-        return jsonify(ok=True, message=str(out.get('result') or 'Registration complete'))
-    else:
-        return jsonify(ok=False, error=out['error'], details=out.get('traceback'))
+    # registration and attendance both need the webcam, so they share one exclusive key
+    return submit_job('register', _register_job, user_id, name, email, samples, key='camera')
 
 @app.route('/api/train', methods=['POST'])
 def api_train():
     if train_model is None:
         return jsonify(ok=False, error='train function not found. Ensure train.py exposes train()')
-    out = run_and_capture(train_model)
-    if out['ok']:
-        return jsonify(ok=True, message=str(out.get('result') or 'Training finished'))
-    else:
-        return jsonify(ok=False, error=out['error'], details=out.get('traceback'))
+    return submit_job('train', _train_job, key='train')
 
 @app.route('/api/attend', methods=['POST'])
 def api_attend():
     if start_attendance is None:
         return jsonify(ok=False, error='attend function not found. Ensure attendance.py exposes attend()')
-    out = run_and_capture(start_attendance)
-    if out['ok']:
-        return jsonify(ok=True, message=str(out.get('result') or 'Attendance run complete'))
-    else:
-        return jsonify(ok=False, error=out['error'], details=out.get('traceback'))
+    return submit_job('attend', _attend_job, key='camera')
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    return jsonify(ok=True, jobs=[j.to_dict() for j in job_manager.list()])
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify(ok=False, error=f'job {job_id} not found'), 404
+    return jsonify(ok=True, job=job.to_dict())
 
 @app.route('/api/attendance', methods=['GET'])
 def api_attendance():
     _ensure_db_init()  # Initialize DB if not already done
-    if fetch_attendance is None:
-        return jsonify(ok=False, error='fetch_attendance not found. Ensure db.py exposes fetch_attendance()')
+    if fetch_attendance_page is None:
+        return jsonify(ok=False, error='fetch_attendance_page not found. Ensure db.py exposes fetch_attendance_page()')
+    # ?limit=&cursor=&from=YYYY-MM-DD&to=YYYY-MM-DD&user_id=&status=  (to is exclusive)
     try:
-        rows = fetch_attendance()
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+    except ValueError:
+        return jsonify(ok=False, error='limit must be an integer'), 400
+    try:
+        rows, next_cursor = fetch_attendance_page(
+            limit=limit,
+            cursor=request.args.get('cursor') or None,
+            start=request.args.get('from') or None,
+            end=request.args.get('to') or None,
+            user_id=request.args.get('user_id') or None,
+            status=request.args.get('status') or None,
+        )
         # rows should be list of dicts or tuples. Normalize to dicts
         normalized = []
         for r in rows:
@@ -348,39 +479,225 @@ def api_attendance():
                     normalized.append({'id': r[0], 'name': r[1], 'email': r[2], 'time': r[3], 'note': r[4]})
                 else:
                     normalized.append({'raw': str(r)})
-        return jsonify(ok=True, rows=normalized)
+        return jsonify(ok=True, rows=normalized, next_cursor=next_cursor)
+    except ValueError as e:
+        # bad cursor or filter value
+        return jsonify(ok=False, error=str(e)), 400
+    except Exception as e:
+        tb = traceback.format_exc()
+        return jsonify(ok=False, error=str(e), details=tb)
+
+@app.route('/api/attendance/stream', methods=['GET'])
+def api_attendance_stream():
+    """
+    Server-Sent Events: one `data:` message per attendance row as it is written.
+    At most SSE_MAX_CLIENTS streams are open at once; beyond that the answer is 503.
+    """
+    subscription = attendance_events.subscribe(limit=SSE_MAX_CLIENTS)
+    if subscription is None:
+        response = jsonify(ok=False, error='too many live attendance streams; try again later')
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                event = subscription.get(timeout=15)
+                if event is None:
+                    yield ': keepalive\n\n'  # keeps proxies from closing an idle stream
+                    continue
+                yield f'data: {json.dumps(event, default=str)}\n\n'
+        finally:
+            subscription.close()
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+    response.call_on_close(subscription.close)  # frees the slot even if the stream never started
+    return response
+
+EXPORT_COLUMNS = ['id', 'user_id', 'name', 'email', 'login_time', 'status']
+
+def _export_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for r in rows:
+        writer.writerow([r.get(c, '') for c in EXPORT_COLUMNS])
+        if buf.tell() >= 64 * 1024:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+def _export_ndjson(rows):
+    chunk = []
+    for r in rows:
+        chunk.append(json.dumps({c: r.get(c) for c in EXPORT_COLUMNS}, default=str))
+        if len(chunk) >= 500:
+            yield ('\n'.join(chunk) + '\n').encode('utf-8')
+            chunk = []
+    if chunk:
+        yield ('\n'.join(chunk) + '\n').encode('utf-8')
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/attendance/export', methods=['GET'])
+def api_attendance_export():
+    """
+    Stream every matching attendance row without building the file in memory.
+    ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&user_id=&status=&gzip=1  (to is exclusive)
+    """
+    _ensure_db_init()
+    if iter_attendance is None:
+        return jsonify(ok=False, error='iter_attendance not found. Ensure db.py exposes iter_attendance()')
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify(ok=False, error='format must be csv or ndjson'), 400
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    try:
+        rows = iter_attendance(
+            start=request.args.get('from') or None,
+            end=request.args.get('to') or None,
+            user_id=request.args.get('user_id') or None,
+            status=request.args.get('status') or None,
+        )
+        # Run the first query before the response starts so DB errors still return JSON
+        first = list(itertools.islice(rows, 1))
     except Exception as e:
         tb = traceback.format_exc()
         return jsonify(ok=False, error=str(e), details=tb)
+    rows = itertools.chain(first, rows)
+
+    body = _export_csv(rows) if fmt == 'csv' else _export_ndjson(rows)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = 'attendance.' + fmt
+    if use_gzip:
+        body = _gzip_stream(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
 
 @app.route('/api/attendance.csv', methods=['GET'])
 def api_attendance_csv():
-    if fetch_attendance is None:
-        return jsonify(ok=False, error='fetch_attendance not found. Ensure db.py exposes fetch_attendance()')
+    return api_attendance_export()
+
+def _truthy(value):
+    return str(value or '').lower() in ('1', 'true', 'yes')
+
+@app.route('/api/recognize', methods=['POST'])
+def api_recognize():
+    """
+    Recognize faces in frames from a remote camera.
+    Body: multipart form with one or more image files (any field name), or a single
+    raw image/jpeg body. Params (query or form): cropped=1 when the images are
+    already face crops, log=1 to record attendance, threshold=<LBPH distance>.
+    Returns {"results": [[{box, user_id, name, confidence, recognized}, ...], ...]}, one list per image.
+    """
+    if recognize_images is None:
+        return jsonify(ok=False, error='recognize_images not found. Ensure attendance.py exposes recognize_images()'), 503
+    _ensure_db_init()  # the user directory is loaded from the DB with the model
+    params = request.values
     try:
-        rows = fetch_attendance()
-        # create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        # header
-        writer.writerow(['id','name','email','time','note'])
-        for r in rows:
-            if isinstance(r, dict):
-                writer.writerow([r.get('id',''), r.get('name',''), r.get('email',''), r.get('time',''), r.get('note','')])
-            else:
-                # tuple handling
-                rlist = list(r)
-                # pad
-                while len(rlist) < 5: rlist.append('')
-                writer.writerow(rlist[:5])
-        mem = io.BytesIO()
-        mem.write(output.getvalue().encode('utf-8'))
-        mem.seek(0)
-        return send_file(mem, mimetype='text/csv', as_attachment=True, download_name='attendance.csv')
+        threshold = float(params.get('threshold', 70))
+    except ValueError:
+        return jsonify(ok=False, error='threshold must be a number'), 400
+    # every file of every field (values() would keep only the first file per field name)
+    uploads = [f for files in request.files.listvalues() for f in files]
+    if len(uploads) > RECOGNIZE_MAX_IMAGES:
+        return jsonify(ok=False, error=f'at most {RECOGNIZE_MAX_IMAGES} images per request'), 413
+    blobs = [f.read() for f in uploads]
+    if not blobs and request.mimetype.startswith('image/'):
+        blobs = [request.get_data()]
+    if not blobs:
+        return jsonify(ok=False, error='send image files as multipart/form-data or a raw image/jpeg body'), 400
+
+    if not _recognize_admission.acquire(blocking=False):
+        if metrics is not None:
+            metrics.RECOGNIZE_REQUESTS.inc(result='rejected')
+        return jsonify(ok=False, error='recognizer busy, retry shortly'), 429, {'Retry-After': '1'}
+    try:
+        with _recognize_workers:
+            images = [decode_image(b) for b in blobs]
+            bad = [i for i, img in enumerate(images) if img is None]
+            if bad:
+                if metrics is not None:
+                    metrics.RECOGNIZE_REQUESTS.inc(result='invalid')
+                return jsonify(ok=False, error=f'could not decode image(s) at index {bad}'), 400
+            results = recognize_images(images, threshold=threshold, cropped=_truthy(params.get('cropped')),
+                                       log=_truthy(params.get('log')))
+        if metrics is not None:
+            metrics.RECOGNIZE_REQUESTS.inc(result='ok')
+        return jsonify(ok=True, results=results)
+    except FileNotFoundError as e:
+        if metrics is not None:
+            metrics.RECOGNIZE_REQUESTS.inc(result='no_model')
+        return jsonify(ok=False, error=str(e)), 503  # no trained model yet
+    except Exception as e:
+        if metrics is not None:
+            metrics.RECOGNIZE_REQUESTS.inc(result='error')
+        tb = traceback.format_exc()
+        return jsonify(ok=False, error=str(e), details=tb), 500
+    finally:
+        _recognize_admission.release()
+
+@app.route('/api/reports/daily', methods=['GET'])
+def api_reports_daily():
+    """
+    First-in / last-out per user per day, read from the attendance_daily rollup.
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&user_id=  (to is exclusive)
+    """
+    _ensure_db_init()
+    if fetch_daily_attendance is None:
+        return jsonify(ok=False, error='fetch_daily_attendance not found. Ensure db.py exposes fetch_daily_attendance()')
+    try:
+        rows = fetch_daily_attendance(
+            start=request.args.get('from') or None,
+            end=request.args.get('to') or None,
+            user_id=request.args.get('user_id') or None,
+        )
+        return jsonify(ok=True, rows=json.loads(json.dumps(rows, default=str)))
+    except Exception as e:
+        tb = traceback.format_exc()
+        return jsonify(ok=False, error=str(e), details=tb)
+
+@app.route('/api/reports/summary', methods=['GET'])
+def api_reports_summary():
+    """
+    Per-user days present and event totals over a range (e.g. a month), from the rollup.
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&user_id=  (to is exclusive)
+    """
+    _ensure_db_init()
+    if fetch_attendance_summary is None:
+        return jsonify(ok=False, error='fetch_attendance_summary not found. Ensure db.py exposes fetch_attendance_summary()')
+    try:
+        rows = fetch_attendance_summary(
+            start=request.args.get('from') or None,
+            end=request.args.get('to') or None,
+            user_id=request.args.get('user_id') or None,
+        )
+        return jsonify(ok=True, rows=json.loads(json.dumps(rows, default=str)))
     except Exception as e:
         tb = traceback.format_exc()
         return jsonify(ok=False, error=str(e), details=tb)
 
+@app.route('/api/reports/rebuild', methods=['POST'])
+def api_reports_rebuild():
+    """Recompute the rollup from raw attendance (after bulk imports or deletes). Body: {from, to} optional."""
+    _ensure_db_init()
+    if rebuild_daily_rollup is None:
+        return jsonify(ok=False, error='rebuild_daily_rollup not found. Ensure db.py exposes rebuild_daily_rollup()')
+    data = request.get_json(silent=True) or {}
+    return submit_job('rollup', _rollup_job, data.get('from') or None, data.get('to') or None, key='rollup')
+
 @app.route('/api/send_email', methods=['POST'])
 def api_send_email():
     if not email_notifier_available:
@@ -410,7 +727,21 @@ def health():
         'fetch_attendance': fetch_attendance is not None,
         'email_notifier': email_notifier_available,
     }
-    return jsonify(ok=True, available=available)
+    return jsonify(ok=True, available=available, active_jobs=job_manager.active_count())
+
+@app.route('/api/model')
+def api_model():
+    """Published and loaded model versions; the recognizer swaps to a new version without a restart."""
+    if model_status is None:
+        return jsonify(ok=False, error='model_cache module not available'), 503
+    return jsonify(ok=True, **model_status())
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Prometheus text-format metrics for the recognition loop, DB helpers and email."""
+    if metrics is None:
+        return jsonify(ok=False, error='metrics module not available'), 503
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # ---------------------
 # Run server
@@ -0,0 +1,127 @@
+# jobs.py
+"""
+Background job manager for long-running dashboard actions (train, attend, register).
+
+Jobs run on a small thread pool so HTTP requests return a job ID at once and
+the dashboard polls /api/jobs/<id>. Jobs that share an exclusive key (e.g. one
+training run at a time, one job using the webcam) are not started twice.
+"""
+
+import os
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", 200))
+
+ACTIVE_STATES = ("queued", "running")
+
+
+class JobConflict(Exception):
+    """Raised when a job with the same exclusive key is already queued or running."""
+
+    def __init__(self, job):
+        super().__init__(f"A '{job.kind}' job is already {job.status} ({job.id}).")
+        self.job = job
+
+
+class Job:
+    def __init__(self, kind, key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.key = key
+        self.status = "queued"
+        self.progress = None  # 0.0 - 1.0 when the job reports it
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def update_progress(self, fraction=None, message=None):
+        """Progress callback handed to the job function."""
+        if fraction is not None:
+            self.progress = max(0.0, min(1.0, float(fraction)))
+        if message is not None:
+            self.message = str(message)
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "result": None if self.result is None else str(self.result),
+            "error": self.error,
+            "traceback": self.traceback,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_s": round((self.started_at or end) - self.created_at, 3),
+            "duration_s": round(end - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._history = history
+
+    def submit(self, kind, fn, *args, key=None, **kwargs):
+        """
+        Queue fn(*args, progress=job.update_progress, **kwargs) and return the Job.
+        Raises JobConflict if an active job already holds `key`.
+        """
+        with self._lock:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and job.status in ACTIVE_STATES:
+                        raise JobConflict(job)
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+            self._trim()
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, progress=job.update_progress, **kwargs)
+            job.status = "succeeded"
+            job.progress = 1.0
+        except Exception as e:
+            job.error = str(e)
+            job.traceback = traceback.format_exc()
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _trim(self):
+        """Drop the oldest finished jobs beyond the history limit."""
+        finished = [jid for jid, j in self._jobs.items() if j.status not in ACTIVE_STATES]
+        for jid in finished[:max(0, len(self._jobs) - self._history)]:
+            del self._jobs[jid]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, limit=50):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return jobs[-limit:][::-1]
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status in ACTIVE_STATES)
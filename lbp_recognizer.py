@@ -0,0 +1,366 @@
+# lbp_recognizer.py
+"""
+Pure NumPy LBP-histogram face recognizer, an alternative to OpenCV's LBPH.
+
+It keeps the interface train.py, model_cache.py and attendance.py already use
+(train, update, predict, read, write), and adds predict_many() so every face
+in a frame is matched in one vectorized pass. Features are computed exactly as
+OpenCV LBPH computes them (radius 1, 8 bilinearly interpolated neighbours, 8x8
+grid), and the gallery is a single contiguous float32 matrix (one row of spatial
+LBP histograms per sample), compared with chi-square (the LBPH metric) or cosine
+distance.
+
+Configuration (environment variables):
+- RECOGNIZER_ENGINE ("lbph" for OpenCV, default; "numpy" for this module)
+- NUMPY_RECOGNIZER_METRIC ("chisq", default, or "cosine")
+- NUMPY_RECOGNIZER_PROTOTYPES (match against up to this many k-means prototype
+  histograms per user instead of every sample; 1 = the user's mean histogram,
+  0 = every sample, default. Faster, usually slightly less accurate)
+- ANN_LISTS (build an approximate nearest-neighbour index with this many
+  k-means inverted lists at train time, stored in gallery.npz; 0 = exact
+  search, default. Around sqrt(number of samples) is a good start)
+- ANN_NPROBE (lists scanned per query, default 4: the recall/speed knob;
+  probing every list is exact search)
+
+Exact chi-square search returns the same distances as OpenCV LBPH confidences
+(up to float32 rounding), so the usual attendance threshold applies. Prototype
+and cosine distances are not on that scale: prototypes match closer than any
+single sample, and cosine distance is 100 * (1 - similarity); both need their
+own threshold.
+"""
+
+import os
+import json
+
+import numpy as np
+
+RECOGNIZER_ENGINE = os.environ.get("RECOGNIZER_ENGINE", "lbph").lower()
+NUMPY_RECOGNIZER_METRIC = os.environ.get("NUMPY_RECOGNIZER_METRIC", "chisq").lower()
+NUMPY_RECOGNIZER_PROTOTYPES = int(os.environ.get("NUMPY_RECOGNIZER_PROTOTYPES", 0))
+ANN_LISTS = int(os.environ.get("ANN_LISTS", 0))
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 4))
+MODEL_FILES = {"lbph": "trainer.yml", "numpy": "gallery.npz"}
+
+_BINS = 256
+_FEATURES = 2  # bumped when histograms_for() changes; older galleries must be retrained
+_CHUNK_ELEMENTS = 1 << 23  # ~32 MB of float32 temporaries per distance chunk
+_EPS = np.float32(np.finfo(np.float32).eps)
+
+
+def model_file(engine=None):
+    """File name of the model inside the trainer directory for an engine."""
+    return MODEL_FILES[engine or RECOGNIZER_ENGINE]
+
+
+def create_recognizer(engine=None):
+    """An untrained recognizer for the configured engine."""
+    engine = engine or RECOGNIZER_ENGINE
+    if engine == "numpy":
+        return LBPHistogramRecognizer()
+    if engine == "lbph":
+        import cv2
+        return cv2.face.LBPHFaceRecognizer_create()
+    raise ValueError(f"Unknown recognizer engine {engine!r}; use one of {sorted(MODEL_FILES)}.")
+
+
+def load_recognizer(path):
+    """Read a saved model, picking the engine from the file extension."""
+    recognizer = create_recognizer("numpy" if path.endswith(".npz") else "lbph")
+    recognizer.read(path)
+    return recognizer
+
+
+class LBPHistogramRecognizer:
+    """Nearest-neighbour matching of 8x8-grid LBP histograms, vectorized over faces and gallery."""
+
+    def __init__(self, size=100, grid=8, metric=None, prototypes=None, ann_lists=None, ann_nprobe=None):
+        self.size = size
+        self.grid = grid
+        self.metric = metric or NUMPY_RECOGNIZER_METRIC
+        if self.metric not in ("chisq", "cosine"):
+            raise ValueError(f"Unknown metric {self.metric!r}; use 'chisq' or 'cosine'.")
+        self.prototypes = NUMPY_RECOGNIZER_PROTOTYPES if prototypes is None else prototypes
+        self.ann_lists = ANN_LISTS if ann_lists is None else ann_lists
+        self.ann_nprobe = ANN_NPROBE if ann_nprobe is None else ann_nprobe
+        self.histograms = np.zeros((0, grid * grid * _BINS), dtype=np.float32)
+        self.labels = np.zeros(0, dtype=np.int32)
+        self.ivf = None  # (centroids, list of each sample) when an ANN index is built
+        self._index = None  # what predictions are matched against, built lazily
+        self._setup_cells()
+
+    def _setup_cells(self):
+        # Like OpenCV: equal cells of (inner // grid) pixels; the leftover edge pixels
+        # go to one extra cell that is dropped
+        inner = self.size - 2
+        cell_of = np.minimum(np.arange(inner) // (inner // self.grid), self.grid)
+        cells = self.grid * self.grid
+        self._cell_map = np.where((cell_of[:, None] < self.grid) & (cell_of[None, :] < self.grid),
+                                  cell_of[:, None] * self.grid + cell_of[None, :], cells).astype(np.int64)
+        self._cell_pixels = np.bincount(self._cell_map.ravel(), minlength=cells + 1)[:cells].astype(np.float32)
+
+    # ---------------------
+    # Features
+    # ---------------------
+
+    def _stack(self, faces):
+        """Resize grayscale crops to size x size and stack them into one (n, size, size) uint8 array."""
+        out = np.empty((len(faces), self.size, self.size), dtype=np.uint8)
+        cv2 = None
+        for i, face in enumerate(faces):
+            face = np.asarray(face)
+            if face.ndim == 3:
+                face = face.mean(axis=2).astype(np.uint8)
+            if face.shape != (self.size, self.size):
+                if cv2 is None:
+                    import cv2
+                face = cv2.resize(face, (self.size, self.size), interpolation=cv2.INTER_AREA)
+            out[i] = face
+        return out
+
+    def histograms_for(self, faces, batch=256):
+        """(n, grid*grid*256) float32 spatial LBP histograms; each cell sums to 1 like OpenCV LBPH."""
+        n = len(faces)
+        cells = self.grid * self.grid
+        out = np.empty((n, cells * _BINS), dtype=np.float32)
+        for start in range(0, n, batch):
+            stack = self._stack(faces[start:start + batch]).astype(np.float32)
+            b, h, w = stack.shape
+            centre = stack[:, 1:-1, 1:-1]
+            codes = np.zeros(centre.shape, dtype=np.int64)
+            for bit, taps in enumerate(_NEIGHBOURS):
+                value = None
+                for dy, dx, weight in taps:
+                    term = weight * stack[:, 1 + dy:h - 1 + dy, 1 + dx:w - 1 + dx]
+                    value = term if value is None else value + term
+                codes |= ((value > centre) | (np.abs(value - centre) < _EPS)).astype(np.int64) << bit
+            # One bincount for the whole batch: bin = (face, cell, code); cell `cells` is the dropped edge
+            flat = (np.arange(b)[:, None, None] * (cells + 1) + self._cell_map) * _BINS + codes
+            counts = np.bincount(flat.ravel(), minlength=b * (cells + 1) * _BINS).reshape(b, cells + 1, _BINS)
+            out[start:start + b] = (counts[:, :cells] / self._cell_pixels[None, :, None]).reshape(b, -1)
+        return out
+
+    # ---------------------
+    # Training
+    # ---------------------
+
+    def train(self, faces, labels):
+        self.histograms = np.ascontiguousarray(self.histograms_for(faces))
+        self.labels = np.asarray(labels, dtype=np.int32).ravel()
+        self.ivf = None
+        if self.ann_lists:
+            self.build_ann_index(self.ann_lists)
+        self._index = None
+
+    def update(self, faces, labels):
+        new = self.histograms_for(faces)
+        self.histograms = np.ascontiguousarray(np.vstack([self.histograms, new]))
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int32).ravel()])
+        if self.ivf is not None:
+            # New samples join their nearest existing list; a full retrain re-clusters
+            centroids, assign = self.ivf
+            self.ivf = (centroids, np.concatenate([assign, _nearest_lists(_coarse(new), centroids, 1)[:, 0]]))
+        elif self.ann_lists:
+            self.build_ann_index(self.ann_lists)
+        self._index = None
+
+    def build_ann_index(self, lists, iterations=10, seed=0):
+        """
+        Cluster the gallery into `lists` inverted lists (spherical k-means on
+        square-rooted histograms, a cheap stand-in for chi-square). predict then
+        scans only the ann_nprobe lists nearest each query.
+        """
+        self.ivf = _spherical_kmeans(self.histograms, lists, iterations, seed)
+        self._index = None
+
+    def _search_index(self):
+        """
+        (matrix, labels, row sums, list bounds) that predictions are matched against.
+        With an ANN index the samples are ordered by list, so list k is the column
+        range bounds[k]:bounds[k + 1].
+        """
+        if self._index is None:
+            matrix, labels, bounds = self.histograms, self.labels, None
+            if self.prototypes and len(labels):
+                matrix, labels = self._prototype_gallery(matrix, labels)
+            elif self.ivf is not None:
+                order = np.argsort(self.ivf[1], kind="stable")
+                matrix, labels = matrix[order], labels[order]
+                bounds = np.searchsorted(self.ivf[1][order], np.arange(len(self.ivf[0]) + 1))
+            if self.metric == "cosine":
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix = np.ascontiguousarray(matrix / np.maximum(norms, _EPS), dtype=np.float32)
+            else:
+                # Bins x samples, so gathering a query's non-zero bins reads contiguous rows
+                matrix = np.ascontiguousarray(matrix.T, dtype=np.float32)
+            self._index = (matrix, labels, matrix.sum(axis=0) if self.metric == "chisq" else None, bounds)
+        return self._index
+
+    def _prototype_gallery(self, matrix, labels):
+        """Up to `prototypes` histograms per user: the means of a per-user k-means (the plain mean for 1)."""
+        rows_out, labels_out = [], []
+        for label in np.unique(labels):
+            rows = matrix[labels == label]
+            k = min(int(self.prototypes), len(rows))
+            if k <= 1:
+                centres = rows.mean(axis=0, keepdims=True)
+            else:
+                _, assign = _spherical_kmeans(rows, k)
+                # Mean histograms (not the unit-length k-means centroids) keep the chi-square scale
+                centres = np.stack([rows[assign == c].mean(axis=0) for c in np.unique(assign)])
+            rows_out.append(centres.astype(np.float32))
+            labels_out.append(np.full(len(centres), label, dtype=np.int32))
+        return np.vstack(rows_out), np.concatenate(labels_out)
+
+    # ---------------------
+    # Prediction
+    # ---------------------
+
+    def _chisq(self, q, gallery_t, gallery_sums, start, stop):
+        """
+        Chi-square-alt distances, 2 * sum((a - b)^2 / (a + b)), from one query to
+        gallery columns start:stop. Where the query bin is 0 the term is just the
+        gallery value, so only the query's non-zero bins (a small fraction of each
+        cell) are compared element-wise.
+        """
+        nz = np.flatnonzero(q)
+        qn = q[nz, None]
+        out = np.empty(stop - start, dtype=np.float32)
+        cols = max(1, _CHUNK_ELEMENTS // max(len(nz), 1))
+        for a in range(start, stop, cols):
+            b = min(a + cols, stop)
+            g = gallery_t[nz, a:b]
+            zero_bins = gallery_sums[a:b] - g.sum(axis=0)
+            total = g + qn
+            g -= qn
+            np.square(g, out=g)
+            g /= total  # qn > 0, so total > 0
+            out[a - start:b - start] = 2 * (zero_bins + g.sum(axis=0))
+        return out
+
+    def _ranges(self, queries, bounds):
+        """Per query, the (start, stop) sample ranges to scan: everything, or the nprobe nearest lists."""
+        n = len(self._index[1])
+        if bounds is None or self.ann_nprobe >= len(bounds) - 1:
+            return [[(0, n)]] * len(queries)
+        probes = _nearest_lists(_coarse(queries), self.ivf[0], self.ann_nprobe)
+        return [[(bounds[k], bounds[k + 1]) for k in row if bounds[k] < bounds[k + 1]] for row in probes]
+
+    def predict_many(self, faces):
+        """[(label, distance)] for every face, matched in one batch. (-1, inf) if the gallery is empty."""
+        if not len(faces):
+            return []
+        if not len(self.labels):
+            return [(-1, float("inf"))] * len(faces)
+        queries = self.histograms_for(faces)
+        matrix, labels, sums, bounds = self._search_index()
+        if self.metric == "cosine":
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), _EPS)
+        results = []
+        for q, ranges in zip(queries, self._ranges(queries, bounds)):
+            best_label, best = -1, float("inf")
+            for start, stop in ranges:
+                if self.metric == "cosine":
+                    dist = 100.0 * (1.0 - matrix[start:stop] @ q)
+                else:
+                    dist = self._chisq(q, matrix, sums, start, stop)
+                j = int(np.argmin(dist))
+                if dist[j] < best:
+                    best_label, best = int(labels[start + j]), float(dist[j])
+            results.append((best_label, best))
+        return results
+
+    def predict(self, face):
+        return self.predict_many([face])[0]
+
+    # ---------------------
+    # Persistence
+    # ---------------------
+
+    def write(self, path):
+        params = {"size": self.size, "grid": self.grid, "features": _FEATURES}
+        arrays = {"histograms": self.histograms, "labels": self.labels}
+        if self.ivf is not None:
+            arrays["ivf_centroids"], arrays["ivf_assign"] = self.ivf
+        with open(path, "wb") as f:
+            np.savez(f, params=json.dumps(params), **arrays)
+
+    def read(self, path):
+        with np.load(path) as data:
+            params = json.loads(str(data["params"]))
+            if params.get("features", 1) != _FEATURES:
+                raise ValueError(f"{path} was built with older LBP features; retrain with `python train.py --full`.")
+            self.size, self.grid = params["size"], params["grid"]
+            self._setup_cells()
+            self.histograms = np.ascontiguousarray(data["histograms"], dtype=np.float32)
+            self.labels = data["labels"].astype(np.int32)
+            self.ivf = (data["ivf_centroids"], data["ivf_assign"]) if "ivf_centroids" in data else None
+        self._index = None
+
+
+def _neighbour_taps(radius=1, neighbours=8):
+    """
+    OpenCV LBPH's circular sampling: for each neighbour, the (dy, dx, weight) pixel
+    taps of its bilinear interpolation, computed in the same float32 arithmetic.
+    """
+    taps = []
+    for n in range(neighbours):
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbours))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbours))
+        fx, fy, cx, cy = int(np.floor(x)), int(np.floor(y)), int(np.ceil(x)), int(np.ceil(y))
+        tx, ty = np.float32(x - fx), np.float32(y - fy)
+        one = np.float32(1)
+        weights = ((fy, fx, (one - tx) * (one - ty)), (fy, cx, tx * (one - ty)),
+                   (cy, fx, (one - tx) * ty), (cy, cx, tx * ty))
+        # Zero-weight taps add exactly nothing; the tiny ones from cos(pi/2) rounding stay
+        taps.append(tuple((dy, dx, w) for dy, dx, w in weights if w != 0))
+    return tuple(taps)
+
+
+_NEIGHBOURS = _neighbour_taps()
+
+
+def _coarse(histograms):
+    """Unit-length square-rooted histograms: their dot product tracks chi-square closely."""
+    roots = np.sqrt(histograms, dtype=np.float32)
+    return roots / np.maximum(np.linalg.norm(roots, axis=1, keepdims=True), _EPS)
+
+
+def _spherical_kmeans(histograms, k, iterations=10, seed=0):
+    """
+    k-means on the _coarse() vectors of histograms, converted a chunk of rows at a
+    time so neither a coarse copy of the gallery nor a k x n membership matrix is
+    ever held. Returns (k unit-length centroids, int32 cluster of each row).
+    """
+    n = len(histograms)
+    k = max(1, min(int(k), n))
+    rows = max(1, _CHUNK_ELEMENTS // max(histograms.shape[1], 1))
+    rng = np.random.default_rng(seed)
+    centroids = _coarse(histograms[rng.choice(n, k, replace=False)])
+    assign = np.empty(n, dtype=np.int32)
+    for step in range(iterations + 1):
+        final = step == iterations  # the last pass only assigns rows to the final centroids
+        sums = None if final else np.zeros_like(centroids)
+        for start in range(0, n, rows):
+            coarse = _coarse(histograms[start:start + rows])
+            ids = _nearest_lists(coarse, centroids, 1)[:, 0]
+            assign[start:start + rows] = ids
+            if sums is not None:
+                # Per-cluster sums via a one-hot matmul over just this chunk's clusters (BLAS, small)
+                used, inverse = np.unique(ids, return_inverse=True)
+                onehot = np.zeros((len(used), len(ids)), dtype=np.float32)
+                onehot[inverse, np.arange(len(ids))] = 1
+                sums[used] += onehot @ coarse
+        if final:
+            break
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        filled = norms[:, 0] > 0  # an empty list keeps its old centroid
+        centroids[filled] = sums[filled] / norms[filled]
+    return np.ascontiguousarray(centroids), assign
+
+
+def _nearest_lists(coarse, centroids, k):
+    """(n, k) indices of the k centroids most similar to each coarse vector, best first."""
+    sims = coarse @ centroids.T
+    k = min(k, sims.shape[1])
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1), axis=1)
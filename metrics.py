@@ -0,0 +1,176 @@
+# metrics.py
+"""
+Minimal in-process metrics with Prometheus text-format export (no extra dependency).
+
+All hot-path metrics are declared here so names stay in one place; modules
+import the ones they update and flask_face_attendance_app.py serves render()
+at /api/metrics.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = self._header()
+        with _lock:
+            items = list(self._values.items())
+        for key, v in items or [((), 0)]:
+            lines.append(f"{self.name}_total{_format_labels(key)} {_format_value(v)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._function = None
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    def set_function(self, fn):
+        """Compute the (unlabelled) value at scrape time."""
+        self._function = fn
+
+    def render(self):
+        lines = self._header()
+        if self._function is not None:
+            try:
+                lines.append(f"{self.name} {_format_value(self._function())}")
+            except Exception:
+                pass
+            return lines
+        with _lock:
+            items = list(self._values.items())
+        for key, v in items or [((), 0)]:
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(v)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = self._header()
+        with _lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+
+def render():
+    """Return every registered metric in Prometheus text exposition format."""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------
+# Hot-path metrics
+# ---------------------
+
+DETECT_SECONDS = Histogram("face_detect_seconds", "Face detection latency per frame.")
+PREDICT_SECONDS = Histogram("face_predict_seconds", "Recognizer predict latency per call (one face, or all of a frame's faces when batched).")
+DB_SECONDS = Histogram("db_query_seconds", "Database helper latency by operation kind.")
+EMAIL_SECONDS = Histogram("email_send_seconds", "SMTP send latency.", buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+FRAMES_PROCESSED = Counter("frames_processed", "Frames that went through face detection.")
+FACES_RECOGNIZED = Counter("faces_recognized", "Detected faces matched to a registered user.")
+FACES_UNKNOWN = Counter("faces_unknown", "Detected faces not matched to a registered user.")
+ATTENDANCE_ROWS_WRITTEN = Counter("attendance_rows_written", "Attendance rows inserted into the database.")
+EMAILS_SENT = Counter("emails_sent", "Emails sent, by result.")
+RECOGNIZE_REQUESTS = Counter("recognize_requests", "/api/recognize requests, by result (ok, rejected, invalid, no_model, error).")
+SMTP_CONNECTS = Counter("smtp_connects", "SMTP sessions opened (logins) by the email delivery worker.")
+
+ATTENDANCE_QUEUE_DEPTH = Gauge("attendance_queue_depth", "Attendance events waiting for the background writer.")
+EMAIL_QUEUE_DEPTH = Gauge("email_queue_depth", "Emails waiting for the delivery worker.")
+EMAIL_OUTBOX_PENDING = Gauge("email_outbox_pending", "Notifications in the email_outbox table not yet sent.")
+SSE_CLIENTS = Gauge("sse_clients", "Connected live attendance (SSE) clients.")
+MODEL_VERSION = Gauge("model_version", "Version of the loaded recognition model (model file mtime).")
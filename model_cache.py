@@ -0,0 +1,258 @@
+# model_cache.py
+"""
+Process-wide cache of the trained model shared by register.py, attendance.py and
+the dashboard, and the versioned layout train.py publishes models into:
+
+  trainer/versions/<version>/   model file, labels.txt, manifest.json
+  trainer/CURRENT               name of the published version
+
+A new version is written to trainer/versions/.tmp-<version>/ and published by
+renaming the directory and then atomically replacing CURRENT, so a reader never
+sees a half-written model. A model trained before versioning (trainer.yml and
+labels.txt directly in trainer/) is used until the first publish.
+
+get_model() parses each model once. LiveModel holds the model the recognition
+loops use: a background thread loads newly published versions and swaps one
+reference, so frames never wait on a reload.
+
+Configuration (environment variables):
+- MODEL_KEEP_VERSIONS (published versions kept on disk, default 3)
+- MODEL_POLL_SECONDS (how often LiveModel checks CURRENT, default 2)
+"""
+
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from metrics import MODEL_VERSION
+from lbp_recognizer import load_recognizer, model_file, RECOGNIZER_ENGINE
+
+TRAINER_DIR = "trainer"
+VERSIONS_DIR = os.path.join(TRAINER_DIR, "versions")
+CURRENT_FILE = os.path.join(TRAINER_DIR, "CURRENT")
+MODEL_FILE = model_file()  # trainer.yml, or gallery.npz for the numpy engine
+MODEL_KEEP_VERSIONS = int(os.environ.get("MODEL_KEEP_VERSIONS", 3))
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", 2))
+
+_lock = threading.Lock()
+_cache = {}  # trainer path -> (stamp, recognizer, label_map)
+
+
+def current_version():
+    """Name of the published model version, or None if only a legacy (or no) model exists."""
+    try:
+        with open(CURRENT_FILE, "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def model_paths(version=None):
+    """(model, labels.txt, manifest.json) paths for version (default: the published one)."""
+    version = version or current_version()
+    directory = os.path.join(VERSIONS_DIR, version) if version else TRAINER_DIR
+    return (os.path.join(directory, MODEL_FILE), os.path.join(directory, "labels.txt"),
+            os.path.join(directory, "manifest.json"))
+
+
+def list_versions():
+    """Published version names, oldest first."""
+    try:
+        names = os.listdir(VERSIONS_DIR)
+    except OSError:
+        return []
+    return sorted(n for n in names if not n.startswith(".") and os.path.isdir(os.path.join(VERSIONS_DIR, n)))
+
+
+def _fsync_dir_files(directory):
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), "rb") as f:
+            os.fsync(f.fileno())
+
+
+@contextmanager
+def publish_version():
+    """
+    Yield an empty staging directory to write a model into. When the block exits
+    cleanly the directory becomes trainer/versions/<version> and CURRENT points at
+    it; on error it is removed and the published model is untouched.
+    """
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    staging = os.path.join(VERSIONS_DIR, ".tmp-" + version)
+    os.makedirs(staging)
+    try:
+        yield staging
+        _fsync_dir_files(staging)
+        os.rename(staging, os.path.join(VERSIONS_DIR, version))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    tmp = CURRENT_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, CURRENT_FILE)
+    print(f"[INFO] Published model version {version}")
+    _prune_versions()
+
+
+def _prune_versions(keep=None):
+    keep = MODEL_KEEP_VERSIONS if keep is None else keep
+    current = current_version()
+    versions = list_versions()
+    for name in versions[:max(len(versions) - keep, 0)]:
+        if name != current:
+            shutil.rmtree(os.path.join(VERSIONS_DIR, name), ignore_errors=True)
+
+
+def _stamp(*paths):
+    """(mtime_ns, size) for each path, or None for a missing file."""
+    out = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            out.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+def load_label_map(labels_path):
+    """Read labels.txt into {int_label: user_id}."""
+    mapping = {}
+    with open(labels_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            idx, uid = line.split(",", 1)
+            mapping[int(idx)] = uid
+    return mapping
+
+
+def get_model(trainer_path=None, labels_path=None):
+    """
+    Return (recognizer, label_map) for the given model files (default: the published
+    version), reloading only when either file's mtime or size changed.
+    Returns (None, None) if no model exists.
+    """
+    if trainer_path is None:
+        trainer_path, default_labels, _ = model_paths()
+        labels_path = labels_path or default_labels
+    labels_path = labels_path or os.path.join(os.path.dirname(trainer_path), "labels.txt")
+    stamp = _stamp(trainer_path, labels_path)
+    cached = _cache.get(trainer_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], cached[2]
+    if stamp[0] is None:
+        return None, None
+    with _lock:
+        cached = _cache.get(trainer_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1], cached[2]
+        recognizer = load_recognizer(trainer_path)
+        label_map = load_label_map(labels_path) if stamp[1] is not None else {}
+        # A superseded version is never read again; don't keep its model in memory
+        for path in list(_cache):
+            superseded = path.startswith(VERSIONS_DIR) and trainer_path.startswith(VERSIONS_DIR)
+            if path != trainer_path and (superseded or not os.path.exists(path)):
+                del _cache[path]
+        _cache[trainer_path] = (stamp, recognizer, label_map)
+        MODEL_VERSION.set(stamp[0][0] / 1e9)
+        return recognizer, label_map
+
+
+def get_recognizer(trainer_path=None):
+    """Return the cached recognizer, or None if the model has not been trained."""
+    return get_model(trainer_path)[0]
+
+
+class LiveModel:
+    """
+    The (recognizer, label_map, version) the recognition loops use. current() is a
+    plain attribute read; a daemon thread polls CURRENT and, when a new version is
+    published, loads it off the frame path and swaps the tuple in one assignment.
+    """
+
+    def __init__(self, poll_seconds=MODEL_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._active = None
+        self._failed_version = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.loaded_at = None
+        self.swaps = 0
+
+    def _load(self, version):
+        model_path, labels_path, _ = model_paths(version)
+        if not os.path.exists(labels_path):
+            raise FileNotFoundError("labels.txt not found. Train model first.")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{MODEL_FILE} not found. Run train.py first.")
+        recognizer, label_map = get_model(model_path, labels_path)
+        self._active = (recognizer, label_map, version or "legacy")
+        self.loaded_at = time.time()
+
+    def start(self):
+        """Load the published model now (raises FileNotFoundError if untrained), then watch for new ones."""
+        if self._active is None:
+            self._load(current_version())
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def current(self):
+        return self._active
+
+    @property
+    def version(self):
+        return self._active[2] if self._active is not None else None
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            version = current_version()
+            if version is None or version == self.version or version == self._failed_version:
+                continue
+            try:
+                self._load(version)
+            except Exception as e:
+                self._failed_version = version  # don't retry a broken version every poll
+                print(f"[WARN] Could not load model version {version}; keeping {self.version}: {e}")
+                continue
+            self.swaps += 1
+            print(f"[INFO] Switched to model version {version}")
+
+
+_live_model = None
+_live_lock = threading.Lock()
+
+
+def get_live_model():
+    """The process-wide LiveModel, loaded on first use. Raises FileNotFoundError until a model is trained."""
+    global _live_model
+    with _live_lock:
+        if _live_model is None:
+            _live_model = LiveModel().start()
+        return _live_model
+
+
+def model_status():
+    """Published version on disk, version loaded in this process, and the versions kept."""
+    live = _live_model
+    return {
+        "engine": RECOGNIZER_ENGINE,
+        "published": current_version(),
+        "loaded": live.version if live is not None else None,
+        "loaded_at": live.loaded_at if live is not None else None,
+        "swaps": live.swaps if live is not None else 0,
+        "versions": list_versions(),
+    }
@@ -0,0 +1,93 @@
+# motion_gate.py
+"""
+Cheap motion gate in front of face detection.
+
+Each grayscale frame is downscaled and compared with the last frame that went
+through detection; static frames are skipped. Detection is also capped at a
+maximum rate, with a keepalive so a still scene is re-checked now and then.
+
+Configuration (environment variables):
+- MOTION_WIDTH (width of the comparison frame, default 160)
+- MOTION_PIXEL_DELTA (grey-level change that counts as motion, default 25)
+- MOTION_THRESHOLD (fraction of changed pixels needed to run detection, default 0.01)
+- MAX_DETECT_FPS (detections per second per stream, 0 = unlimited, default 10)
+- MOTION_KEEPALIVE (seconds; force a detection after this long without one, default 2.0)
+"""
+
+import os
+import time
+import threading
+
+MOTION_WIDTH = int(os.environ.get("MOTION_WIDTH", 160))
+MOTION_PIXEL_DELTA = int(os.environ.get("MOTION_PIXEL_DELTA", 25))
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", 0.01))
+MAX_DETECT_FPS = float(os.environ.get("MAX_DETECT_FPS", 10))
+MOTION_KEEPALIVE = float(os.environ.get("MOTION_KEEPALIVE", 2.0))
+
+_cv2 = None
+
+def _get_cv2():
+    """Import cv2 only when first needed."""
+    global _cv2
+    if _cv2 is None:
+        import cv2
+        _cv2 = cv2
+    return _cv2
+
+
+class MotionGate:
+    """Decides per frame whether face detection should run."""
+
+    def __init__(self, width=MOTION_WIDTH, pixel_delta=MOTION_PIXEL_DELTA, threshold=MOTION_THRESHOLD,
+                 max_fps=MAX_DETECT_FPS, keepalive=MOTION_KEEPALIVE):
+        self.width = width
+        self.pixel_delta = pixel_delta
+        self.threshold = threshold
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.keepalive = keepalive
+        self._reference = None
+        self._last_run = 0.0
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.skipped_static = 0
+        self.skipped_rate = 0
+
+    def _small(self, gray):
+        cv2 = _get_cv2()
+        h, w = gray.shape[:2]
+        if w > self.width:
+            gray = cv2.resize(gray, (self.width, max(1, h * self.width // w)), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_process(self, gray, now=None):
+        """Return True if detection should run on this grayscale frame."""
+        cv2 = _get_cv2()
+        now = time.monotonic() if now is None else now
+        small = self._small(gray)
+        with self._lock:
+            if now - self._last_run < self.min_interval:
+                self.skipped_rate += 1
+                return False
+            moved = True
+            if self._reference is not None and self._reference.shape == small.shape:
+                diff = cv2.absdiff(small, self._reference)
+                changed = cv2.countNonZero(cv2.threshold(diff, self.pixel_delta, 255, cv2.THRESH_BINARY)[1])
+                moved = changed >= self.threshold * small.size
+            if not moved and now - self._last_run < self.keepalive:
+                self.skipped_static += 1
+                return False
+            # Compare later frames with the last one detection actually saw, so slow movement accumulates
+            self._reference = small
+            self._last_run = now
+            self.processed += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            total = self.processed + self.skipped_static + self.skipped_rate
+            return {
+                "frames_processed": self.processed,
+                "frames_skipped_static": self.skipped_static,
+                "frames_skipped_rate": self.skipped_rate,
+                "skip_ratio": round((total - self.processed) / total, 3) if total else 0.0,
+            }
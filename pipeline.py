@@ -0,0 +1,253 @@
+# pipeline.py
+"""
+Multi-camera attendance pipeline.
+
+Each camera source gets a capture thread that keeps only its latest frame, so a
+slow detector never builds up a backlog. A shared pool of worker threads runs
+detection + recognition (OpenCV releases the GIL), at most one frame per stream
+at a time so each stream's face tracker sees frames in order, and every result
+goes into a single AttendanceWriter. Per-stream fps and latency are reported periodically.
+
+Usage: python pipeline.py 0 1 rtsp://door-2/stream --workers 4
+"""
+
+import os
+import time
+import argparse
+import threading
+from collections import deque
+
+from attendance import _lazy_import_cv2, _lazy_load_model, process_frame
+from attendance_writer import AttendanceWriter
+from motion_gate import MotionGate
+from face_tracker import FaceTracker
+
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", os.cpu_count() or 2))
+
+
+def _parse_source(source):
+    """Device indices arrive as strings on the command line."""
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+class _Stream:
+    """Latest-frame-only buffer plus counters for one camera source."""
+
+    def __init__(self, source):
+        self.source = source
+        self.frame = None
+        self.captured_at = 0.0
+        self.seq = 0
+        self.taken_seq = 0
+        self.finished = False
+        self.captured = 0
+        self.processed = 0
+        self.overwritten = 0  # frames replaced before any worker picked them up
+        self.faces = 0
+        self.errors = 0  # frames whose recognition raised (e.g. a transient DB error)
+        self.latencies = deque(maxlen=1000)  # capture -> result, seconds
+        self.gate = MotionGate()
+        self.tracker = FaceTracker()
+        self.busy = False  # one frame in flight per stream keeps the tracker's frames in order
+        self.started = time.monotonic()
+
+    def has_new_frame(self):
+        return self.seq > self.taken_seq
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lat = sorted(self.latencies)
+        return {
+            "source": str(self.source),
+            "capture_fps": round(self.captured / elapsed, 1),
+            "processed_fps": round(self.processed / elapsed, 1),
+            "frames_captured": self.captured,
+            "frames_processed": self.processed,
+            "frames_overwritten": self.overwritten,
+            "faces": self.faces,
+            "errors": self.errors,
+            "latency_ms_avg": round(1000 * sum(lat) / len(lat), 1) if lat else None,
+            "latency_ms_p95": round(1000 * lat[int(0.95 * (len(lat) - 1))], 1) if lat else None,
+            "finished": self.finished,
+            **self.gate.stats(),
+            **self.tracker.stats(),
+        }
+
+
+class Pipeline:
+    """N capture threads feeding a shared pool of detection/recognition workers."""
+
+    def __init__(self, sources, workers=PIPELINE_WORKERS, threshold=70, writer=None, detection=None):
+        self.streams = [_Stream(_parse_source(s)) for s in sources]
+        self.workers = max(1, workers)
+        self.threshold = threshold
+        self.detection = detection
+        self.writer = writer
+        self._own_writer = writer is None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []  # capture threads
+        self._workers = []
+        self._last_logged = {}  # shared across streams: one person walking past two doors logs once
+        self._last_logged_lock = threading.Lock()
+        self._next = 0  # round-robin cursor over streams
+
+    def start(self):
+        cv2 = _lazy_import_cv2()
+        _lazy_load_model()  # fail fast if no model is trained
+        if self.writer is None:
+            self.writer = AttendanceWriter()
+        self.writer.start()
+        for stream in self.streams:
+            cam = cv2.VideoCapture(stream.source)
+            if not cam.isOpened():
+                print(f"[WARN] Could not open camera source {stream.source!r}; skipping it.")
+                stream.finished = True
+                continue
+            t = threading.Thread(target=self._capture, args=(cam, stream),
+                                 name=f"capture-{stream.source}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"recognize-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        return self
+
+    def _capture(self, cam, stream):
+        try:
+            while not self._stop.is_set():
+                ret, img = cam.read()
+                if not ret:
+                    break
+                with self._cond:
+                    if stream.has_new_frame():
+                        stream.overwritten += 1
+                    stream.frame = img
+                    stream.captured_at = time.monotonic()
+                    stream.seq += 1
+                    stream.captured += 1
+                    self._cond.notify()
+        finally:
+            cam.release()
+            with self._cond:
+                stream.finished = True
+                self._cond.notify_all()
+
+    def _take(self):
+        """Block until some stream has an unprocessed frame; return (stream, frame, captured_at) or None."""
+        with self._cond:
+            while not self._stop.is_set():
+                n = len(self.streams)
+                for k in range(n):
+                    stream = self.streams[(self._next + k) % n]
+                    if stream.has_new_frame() and not stream.busy:
+                        self._next = (self._next + k + 1) % n
+                        stream.taken_seq = stream.seq
+                        stream.busy = True
+                        return stream, stream.frame, stream.captured_at
+                if all(s.finished for s in self.streams):
+                    return None
+                self._cond.wait(0.5)
+            return None
+
+    def _work(self):
+        cv2 = _lazy_import_cv2()
+        while True:
+            item = self._take()
+            if item is None:
+                break
+            stream, img, captured_at = item
+            results = None
+            failed = False
+            try:
+                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+                if stream.gate.should_process(gray):
+                    # shared active model version; face_cascade is this worker thread's own
+                    recognizer, face_cascade, label_map = _lazy_load_model()
+                    results = process_frame(gray, recognizer, face_cascade, label_map, self.threshold,
+                                            self.writer, self._last_logged, self._last_logged_lock,
+                                            tracker=stream.tracker, detection=self.detection)
+            except Exception as e:
+                # One bad frame must not take the worker down; carry on with the next one
+                failed = True
+                print(f"[ERROR] Frame from {stream.source!r} failed: {e}")
+            finally:
+                done = time.monotonic()
+                with self._cond:
+                    stream.busy = False
+                    if failed:
+                        stream.errors += 1
+                    if results is not None:
+                        stream.processed += 1
+                        stream.faces += len(results)
+                        stream.latencies.append(done - captured_at)
+                    self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return [s.stats() for s in self.streams]
+
+    def done(self):
+        with self._cond:
+            # busy: the stream's last frame is still being recognized
+            return all(s.finished and not s.has_new_frame() and not s.busy for s in self.streams)
+
+    def stop(self, timeout=5.0):
+        """
+        Stop capturing (waiting up to `timeout` per camera), let workers finish their
+        in-flight frames, then close the writer so every result is written.
+        """
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        for t in self._workers:
+            t.join()  # at most one frame's work left; the writer must outlive it
+        if self._own_writer and self.writer is not None:
+            self.writer.close()
+
+    def run(self, duration=None, report_every=5.0):
+        """Run until every source is exhausted, `duration` seconds pass, or Ctrl+C."""
+        self.start()
+        deadline = time.monotonic() + duration if duration else None
+        next_report = time.monotonic() + report_every
+        try:
+            while not self.done():
+                if deadline and time.monotonic() >= deadline:
+                    break
+                time.sleep(0.1)
+                if time.monotonic() >= next_report:
+                    _print_stats(self.stats())
+                    next_report += report_every
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        _print_stats(self.stats())
+        return self.stats()
+
+
+def _print_stats(stats):
+    for s in stats:
+        print(f"[STATS] {s['source']}: capture {s['capture_fps']} fps, processed {s['processed_fps']} fps, "
+              f"overwritten {s['frames_overwritten']}, gated {s['frames_skipped_static'] + s['frames_skipped_rate']}, "
+              f"faces {s['faces']}, predictions {s['predictions']}, errors {s['errors']}, "
+              f"latency avg {s['latency_ms_avg']} ms / p95 {s['latency_ms_p95']} ms")
+
+
+def run_pipeline(sources, workers=PIPELINE_WORKERS, threshold=70, duration=None):
+    return Pipeline(sources, workers=workers, threshold=threshold).run(duration=duration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-camera attendance pipeline.")
+    parser.add_argument("sources", nargs="+", help="camera indices, video files or stream URLs")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS)
+    parser.add_argument("--threshold", type=float, default=70)
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    args = parser.parse_args()
+    run_pipeline(args.sources, workers=args.workers, threshold=args.threshold, duration=args.duration)
@@ -1,11 +1,14 @@
 """
-Register new user: capture face images, check duplicates, and save to dataset.
+Register new user: capture face images, check duplicates, and save to the sample store.
 Optimized with lazy OpenCV loading for faster imports.
 """
 
 import os
 import numpy as np
 from db import add_user, get_user_by_email
+from sample_store import ensure_store, fit_face
+from model_cache import get_recognizer
+from detection import detect_faces
 from datetime import datetime
 
 # Lazy-load OpenCV to speed up module import
@@ -22,7 +25,6 @@ def _get_cv2():
 CASCADE_PATH = os.path.join("haarcascades", "haarcascade_frontalface_default.xml")
 DATASET_DIR = "dataset"
 TRAINER_DIR = "trainer"
-TRAINER_FILE = os.path.join(TRAINER_DIR, "trainer.yml")
 
 
 def ensure_dirs():
@@ -38,22 +40,26 @@ def check_duplicate_email(email):
     return user is not None
 
 
-def check_duplicate_face(face_roi):
-    """Check if this face already exists using the trained model."""
-    if not os.path.exists(TRAINER_FILE):
+def check_duplicate_face(face_roi, recognizer=None):
+    """
+    Check if this face already exists using the trained model.
+    Pass the recognizer from model_cache.get_recognizer() to skip the cache stat per face.
+    """
+    if recognizer is None:
+        recognizer = get_recognizer()
+    if recognizer is None:
         return False  # No trained data yet
-    cv2 = _get_cv2()
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.read(TRAINER_FILE)
-    label, confidence = recognizer.predict(face_roi)
+    label, confidence = recognizer.predict(fit_face(face_roi))  # compare at the trained crop size
     # Lower confidence = more similar (0 = identical)
     return confidence < 70  # Adjust threshold if needed
 
 
-def register_user(user_id: str, name: str, email: str, samples=30):
+def register_user(user_id: str, name: str, email: str, samples=30, detection=None, progress=None):
     """
     Capture 'samples' images of the user's face via webcam.
     Prevent duplicate faces or emails.
+    detection: optional detection.DetectionConfig (defaults to the environment settings).
+    progress: optional callback(fraction, message), e.g. from the dashboard job manager.
     """
     ensure_dirs()
 
@@ -64,12 +70,14 @@ def register_user(user_id: str, name: str, email: str, samples=30):
     # Initialize face detection
     cv2 = _get_cv2()
     face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
+    recognizer = get_recognizer()  # parsed once, shared with attendance
     cam = cv2.VideoCapture(0)
     if not cam.isOpened():
         raise RuntimeError("Could not open webcam.")
 
     print(f"[INFO] Starting capture for {name} ({user_id}). Press 'q' to quit early.")
     count = 0
+    captured = []  # crops are written to the sample store once capture succeeds
     duplicate_detected = False
 
     # Capture loop
@@ -79,20 +87,21 @@ def register_user(user_id: str, name: str, email: str, samples=30):
             print("[ERROR] Camera read failed.")
             break
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5)
+        faces = detect_faces(face_cascade, gray, detection)
 
         for (x, y, w, h) in faces:
             face_roi = gray[y:y+h, x:x+w]
 
             # Check if this face already exists
-            if check_duplicate_face(face_roi):
+            if recognizer is not None and check_duplicate_face(face_roi, recognizer):
                 print("This face already exists in the system! Registration aborted.")
                 duplicate_detected = True
                 break
 
             count += 1
-            filepath = os.path.join(DATASET_DIR, f"{user_id}_{count}.jpg")
-            cv2.imwrite(filepath, face_roi)
+            captured.append(face_roi.copy())
+            if progress:
+                progress(count / float(samples), f"Captured {count}/{samples}")
             cv2.rectangle(img, (x, y), (x+w, y+h), (255, 0, 0), 2)
             cv2.putText(img, f"{count}/{samples}", (x, y-10),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 0, 0), 2)
@@ -109,6 +118,9 @@ def register_user(user_id: str, name: str, email: str, samples=30):
     if duplicate_detected:
         raise ValueError("Registration aborted: This face already exists in the system!")
 
+    # Save samples into the packed store
+    ensure_store(DATASET_DIR).append_many(user_id, captured)
+
     # Save user info in DB
     add_user(user_id, name, email)
     print(f"[INFO] Collected {count} images for {name}.")
@@ -0,0 +1,211 @@
+# sample_store.py
+"""
+Packed face sample store: fixed-size grayscale crops in one memory-mapped file
+instead of thousands of small JPEGs in dataset/.
+
+Layout:
+  - dataset/samples.bin (uint8 crops of SAMPLE_SIZE x SAMPLE_SIZE, back to back)
+  - dataset/samples.idx (header "size,<h>,<w>" then one "<byte offset>,<user_id>" line per crop)
+
+Crops are appended; readers map the data file and get zero-copy views.
+fit_face() resizes a crop to the store size; training and recognition both use it
+so the model always compares faces at the scale it was trained on.
+Run `python sample_store.py --migrate` once to pack an existing dataset/ of JPEGs.
+"""
+
+import os
+import argparse
+import threading
+import time
+import numpy as np
+
+DATASET_DIR = "dataset"
+STORE_DATA = os.path.join(DATASET_DIR, "samples.bin")
+STORE_INDEX = os.path.join(DATASET_DIR, "samples.idx")
+SAMPLE_SIZE = int(os.environ.get("SAMPLE_SIZE", 100))
+
+# Lazy-load OpenCV; only appends (resizing) and migration need it
+_cv2 = None
+
+def _get_cv2():
+    """Import cv2 only when first needed."""
+    global _cv2
+    if _cv2 is None:
+        import cv2
+        _cv2 = cv2
+    return _cv2
+
+
+def fit_face(face_img, shape=None):
+    """Return face_img as a contiguous uint8 crop of shape (default: face_shape())."""
+    shape = shape or face_shape()
+    face_img = np.asarray(face_img, dtype=np.uint8)
+    if face_img.shape != shape:
+        cv2 = _get_cv2()
+        face_img = cv2.resize(face_img, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(face_img)
+
+
+_face_shape = None
+_default_shape_until = 0.0  # before a store exists, reuse the default shape until then
+DEFAULT_SHAPE_RECHECK_SECONDS = 30
+
+def face_shape():
+    """Crop shape models are trained on: the store's size, or SAMPLE_SIZE before a store exists."""
+    global _face_shape, _default_shape_until
+    if _face_shape is not None:
+        return _face_shape  # fixed once the store is created
+    if time.monotonic() < _default_shape_until:
+        return (SAMPLE_SIZE, SAMPLE_SIZE)
+    store = SampleStore()
+    if store.exists():
+        _face_shape = store.shape
+        return _face_shape
+    # No store yet: don't stat per predict; another process may create one meanwhile
+    _default_shape_until = time.monotonic() + DEFAULT_SHAPE_RECHECK_SECONDS
+    return store.shape
+
+
+def _store_created(shape):
+    """Pin face_shape() to a store this process just created."""
+    global _face_shape
+    _face_shape = shape
+
+
+class SampleStore:
+    """Append-only packed store of grayscale face crops with a user_id index."""
+
+    def __init__(self, data_path=STORE_DATA, index_path=STORE_INDEX, size=SAMPLE_SIZE):
+        self.data_path = data_path
+        self.index_path = index_path
+        self.shape = (size, size)
+        self._lock = threading.Lock()
+        if os.path.exists(index_path):
+            # An existing store keeps the crop size it was created with
+            with open(index_path, "r") as f:
+                header = f.readline().strip().split(",")
+            if header[0] == "size":
+                self.shape = (int(header[1]), int(header[2]))
+
+    @property
+    def frame_bytes(self):
+        return self.shape[0] * self.shape[1]
+
+    def exists(self):
+        return os.path.exists(self.index_path) and os.path.exists(self.data_path)
+
+    def _read_index(self):
+        """Return [(offset, user_id)] for every complete crop."""
+        entries = []
+        if not os.path.exists(self.index_path):
+            return entries
+        with open(self.index_path, "r") as f:
+            f.readline()  # header
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                offset, uid = line.split(",", 1)
+                entries.append((int(offset), uid))
+        # Ignore index lines whose crop never fully reached the data file (interrupted append)
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        return [(o, u) for o, u in entries if o + self.frame_bytes <= data_size]
+
+    def __len__(self):
+        return len(self._read_index())
+
+    def user_ids(self):
+        """Return the user_id of every stored crop, in row order."""
+        return [uid for _, uid in self._read_index()]
+
+    def images(self):
+        """Return all crops as a read-only (n, h, w) uint8 memmap; rows are zero-copy views."""
+        n = len(self._read_index())
+        if n == 0:
+            return np.empty((0,) + self.shape, dtype=np.uint8)
+        return np.memmap(self.data_path, dtype=np.uint8, mode="r", shape=(n,) + self.shape)
+
+    def append_many(self, user_id: str, faces):
+        """Append grayscale crops for user_id (resized to the store size). Returns the new row count."""
+        crops = [fit_face(f, self.shape) for f in faces]
+        if not crops:
+            return len(self)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.data_path) or ".", exist_ok=True)
+            if not os.path.exists(self.index_path):
+                with open(self.index_path, "w") as f:
+                    f.write(f"size,{self.shape[0]},{self.shape[1]}\n")
+                if self.index_path == STORE_INDEX:
+                    _store_created(self.shape)
+            # Drop bytes left by an interrupted append so rows stay contiguous
+            end = len(self._read_index()) * self.frame_bytes
+            if os.path.exists(self.data_path) and os.path.getsize(self.data_path) > end:
+                os.truncate(self.data_path, end)
+            # Data first, then index, so a crash never indexes a missing crop
+            with open(self.data_path, "ab") as data:
+                offset = data.tell()
+                for crop in crops:
+                    data.write(crop.tobytes())
+            with open(self.index_path, "a") as index:
+                for i in range(len(crops)):
+                    index.write(f"{offset + i * self.frame_bytes},{user_id}\n")
+        return len(self)
+
+    def append(self, user_id: str, face_img):
+        return self.append_many(user_id, [face_img])
+
+
+def migrate_from_dataset(dataset_dir=DATASET_DIR, store=None):
+    """
+    One-shot migration of dataset/<user_id>_<n>.jpg files into the packed store.
+    JPEGs are left in place. Returns the number of crops migrated.
+    """
+    store = store or SampleStore()
+    if store.exists() and len(store):
+        raise RuntimeError(f"Sample store at {store.data_path} already has data; refusing to migrate twice.")
+    cv2 = _get_cv2()
+
+    def _order(name):
+        uid, _, count = name[:-4].rpartition("_")
+        return (uid, int(count) if count.isdigit() else 0)
+
+    names = sorted((f for f in os.listdir(dataset_dir) if f.endswith(".jpg")), key=_order)
+    migrated = 0
+    skipped = []
+    by_user = {}
+    for name in names:
+        img = cv2.imread(os.path.join(dataset_dir, name), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            skipped.append(name)
+            continue
+        by_user.setdefault(name.split("_")[0], []).append(img)
+    for uid, faces in by_user.items():
+        store.append_many(uid, faces)
+        migrated += len(faces)
+    print(f"[INFO] Migrated {migrated} samples into {store.data_path}")
+    if skipped:
+        print(f"[WARN] Skipped {len(skipped)} unreadable files: {', '.join(skipped)}")
+    return migrated
+
+
+def ensure_store(dataset_dir=DATASET_DIR):
+    """
+    Return the sample store, first migrating legacy JPEGs if the store does not
+    exist yet, so the first packed registration does not hide older users from training.
+    """
+    store = SampleStore()
+    if not store.exists() and os.path.isdir(dataset_dir) and \
+            any(f.endswith(".jpg") for f in os.listdir(dataset_dir)):
+        migrate_from_dataset(dataset_dir, store)
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packed face sample store.")
+    parser.add_argument("--migrate", action="store_true", help="pack dataset/*.jpg into the store")
+    args = parser.parse_args()
+    if args.migrate:
+        migrate_from_dataset()
+    else:
+        store = SampleStore()
+        print(f"{len(store)} samples in {store.data_path}")
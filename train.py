@@ -1,59 +1,253 @@
 # train.py
 """
-Train LBPH face recognizer on images in dataset/.
-Assumes filenames like <user_id>_<count>.jpg
-Saves:
-  - trainer/trainer.yml (trained model)
-  - trainer/labels.txt (mapping: <int_label>,<user_id>)
+Train the face recognizer on the packed sample store (dataset/samples.bin, see
+sample_store.py), or on images in dataset/ when no store exists.
+The JPEG fallback assumes filenames like <user_id>_<count>.jpg
+Each run publishes a new model version, trainer/versions/<version>/ (see model_cache.py), with:
+  - trainer.yml (trained model; gallery.npz with RECOGNIZER_ENGINE=numpy,
+    see lbp_recognizer.py, which also holds the ANN index when ANN_LISTS is set)
+  - labels.txt (mapping: <int_label>,<user_id>)
+  - manifest.json (samples already in the model, for incremental updates)
+The version is written to a temporary directory and published atomically, so
+running recognizers keep the old model until the new one is complete.
+
+By default only samples added since the last run are fed to the existing model
+via update(). Use train(full=True) or `python train.py --full` to rebuild.
+Label IDs are stable: existing users keep their label, new users get the next free one.
 """
 
 import cv2
 import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from collections import defaultdict
+from sample_store import SampleStore, fit_face, face_shape
+from lbp_recognizer import create_recognizer, load_recognizer, ANN_LISTS
+from model_cache import model_paths, publish_version, MODEL_FILE
 
 DATASET_DIR = "dataset"
 TRAINER_DIR = "trainer"
 CASCADE_PATH = os.path.join("haarcascades", "haarcascade_frontalface_default.xml")
+TRAIN_WORKERS = int(os.environ.get("TRAIN_WORKERS", os.cpu_count() or 4))
+
+
+def _load_label_map():
+    """Return the published user_id -> label mapping from labels.txt (empty if none)."""
+    label_map = {}
+    labels_path = model_paths()[1]
+    if not os.path.exists(labels_path):
+        return label_map
+    with open(labels_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            idx, uid = line.split(",", 1)
+            label_map[uid] = int(idx)
+    return label_map
+
+
+def _assign_labels(label_map, user_ids):
+    """Give each unseen user the next free label, leaving existing labels untouched."""
+    next_label = max(label_map.values(), default=-1) + 1
+    for uid in sorted(user_ids):
+        if uid not in label_map:
+            label_map[uid] = next_label
+            next_label += 1
+    return label_map
+
+
+def _load_manifest():
+    """The published model's manifest, or None if there is no usable model to update."""
+    model_path, _, manifest_path = model_paths()
+    if not os.path.exists(manifest_path) or not os.path.exists(model_path):
+        return None
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-def train():
-    os.makedirs(TRAINER_DIR, exist_ok=True)
-    image_paths = [os.path.join(DATASET_DIR, f) for f in os.listdir(DATASET_DIR) if f.endswith(".jpg")]
-    if not image_paths:
-        raise RuntimeError("No images in dataset/. Register users first.")
 
-    # Build mapping user_id -> numeric label
-    user_ids = sorted({os.path.basename(p).split("_")[0] for p in image_paths})
-    label_map = {uid: idx for idx, uid in enumerate(user_ids)}
+def _save_manifest(manifest, directory):
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
 
+
+def _sample_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, int(st.st_mtime)]
+
+
+def _decode_gray(img_path):
+    """Decode one sample as grayscale; None if the file is unreadable."""
+    return cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+
+
+def _read_samples(image_names, label_map, workers=None):
+    """
+    Decode samples on a thread pool (cv2.imread releases the GIL) and pair them
+    with their numeric labels. Returns (faces, labels, loaded_names, corrupt_names).
+    """
+    workers = workers or TRAIN_WORKERS
     faces = []
     labels = []
-    for img_path in image_paths:
-        img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            continue
-        basename = os.path.basename(img_path)
-        uid = basename.split("_")[0]
-        label = label_map[uid]
-        faces.append(img)
-        labels.append(label)
-
-    faces_np = faces  # LBPH accepts list of numpy arrays
-    labels_np = np.array(labels)
-
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    print("[INFO] Training LBPH recognizer on", len(faces_np), "faces...")
-    recognizer.train(faces_np, labels_np)
-    model_path = os.path.join(TRAINER_DIR, "trainer.yml")
-    recognizer.write(model_path)
-    print(f"[INFO] Saved trainer at {model_path}")
-
-    # Save labels mapping
-    labels_path = os.path.join(TRAINER_DIR, "labels.txt")
-    with open(labels_path, "w") as f:
-        for uid, idx in label_map.items():
-            f.write(f"{idx},{uid}\n")
-    print(f"[INFO] Saved label map at {labels_path}")
+    loaded = []
+    corrupt = []
+    paths = [os.path.join(DATASET_DIR, n) for n in image_names]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # map() yields in submission order as decodes complete, so results stream in
+        for name, img in zip(image_names, pool.map(_decode_gray, paths)):
+            if img is None:
+                corrupt.append(name)
+                continue
+            faces.append(fit_face(img))  # same crop size the recognizer is queried with
+            labels.append(label_map[name.split("_")[0]])
+            loaded.append(name)
+    elapsed = time.perf_counter() - start
+    rate = len(image_names) / elapsed if elapsed > 0 else 0.0
+    print(f"[INFO] Decoded {len(faces)} images in {elapsed:.2f}s ({rate:.0f} images/sec, {workers} workers)")
+    if corrupt:
+        print(f"[WARN] Skipped {len(corrupt)} unreadable samples: {', '.join(corrupt)}")
+    return faces, labels, loaded, corrupt
+
+
+def _no_progress(fraction=None, message=None):
+    pass
+
+
+def _fit_and_save(faces, labels, label_map, full, manifest, progress=_no_progress):
+    """
+    Train (full) or update (incremental) the recognizer, then publish model, labels
+    and manifest together as a new model version.
+    """
+    labels_np = np.array(labels)  # both engines accept a list of numpy arrays for faces
+    progress(0.5, f"{'Training' if full else 'Updating'} on {len(faces)} faces")
+    if full:
+        recognizer = create_recognizer()
+        print("[INFO] Training recognizer on", len(faces), "faces...")
+        recognizer.train(faces, labels_np)
+    else:
+        recognizer = load_recognizer(model_paths()[0])
+        print("[INFO] Updating recognizer with", len(faces), "new faces...")
+        recognizer.update(faces, labels_np)
+    if getattr(recognizer, "ivf", None) is not None:
+        print(f"[INFO] ANN index: {len(recognizer.ivf[0])} lists over {len(recognizer.ivf[1])} samples "
+              f"(probing {recognizer.ann_nprobe} per query)")
+    elif ANN_LISTS and not hasattr(recognizer, "build_ann_index"):
+        print("[WARN] ANN_LISTS needs RECOGNIZER_ENGINE=numpy; the OpenCV LBPH model is searched exhaustively.")
+    progress(0.9, "Saving model")
+    with publish_version() as staging:
+        recognizer.write(os.path.join(staging, MODEL_FILE))
+        # Save labels mapping
+        with open(os.path.join(staging, "labels.txt"), "w") as f:
+            for uid, idx in sorted(label_map.items(), key=lambda kv: kv[1]):
+                f.write(f"{idx},{uid}\n")
+        _save_manifest(manifest, staging)
+
+
+def _train_from_store(store, full, progress=_no_progress):
+    """Train from the packed sample store; rows are appended, so new rows are the tail."""
+    user_ids = store.user_ids()
+    if not user_ids:
+        raise RuntimeError("No samples in the sample store. Register users first.")
+    label_map = _assign_labels(_load_label_map(), set(user_ids))
+
+    start = 0
+    if not full:
+        trained_rows = (_load_manifest() or {}).get("store_rows")
+        if trained_rows is None:
+            print("[INFO] No previous model manifest; doing a full rebuild.")
+            full = True
+        elif trained_rows > len(user_ids):
+            print("[INFO] Sample store shrank since the last model; doing a full rebuild.")
+            full = True
+        else:
+            start = trained_rows
+    if start == len(user_ids):
+        print("[INFO] Model is up to date; no new samples.")
+        return
+
+    images = store.images()
+    t0 = time.perf_counter()
+    faces = [images[i] for i in range(start, len(user_ids))]  # zero-copy views into the memmap
+    labels = [label_map[uid] for uid in user_ids[start:]]
+    print(f"[INFO] Mapped {len(faces)} samples from {store.data_path} in {time.perf_counter() - t0:.2f}s")
+    _fit_and_save(faces, labels, label_map, full, {"store_rows": len(user_ids)}, progress)
+
+
+def _train_from_jpegs(full, progress=_no_progress):
+    image_names = sorted(f for f in os.listdir(DATASET_DIR) if f.endswith(".jpg"))
+    if not image_names:
+        raise RuntimeError("No images in dataset/. Register users first.")
+    current = {name: _sample_stamp(os.path.join(DATASET_DIR, name)) for name in image_names}
+
+    # Build mapping user_id -> numeric label, keeping previously issued labels
+    user_ids = {name.split("_")[0] for name in image_names}
+    label_map = _assign_labels(_load_label_map(), user_ids)
+
+    manifest = _load_manifest() or {}
+    trained = manifest.get("samples")
+    face_size = list(face_shape())
+    if not full:
+        if trained is None:
+            print("[INFO] No previous model manifest; doing a full rebuild.")
+            full = True
+        elif manifest.get("face_size") != face_size:
+            # Older models were trained on full-size crops; mixing scales skews distances
+            print("[INFO] Model was trained at a different crop size; doing a full rebuild.")
+            full = True
+        else:
+            # LBPH cannot forget samples, so any removed or rewritten file forces a rebuild
+            stale = [n for n, stamp in trained.items() if current.get(n) != stamp]
+            if stale:
+                print(f"[INFO] {len(stale)} trained samples were removed or changed; doing a full rebuild.")
+                full = True
+
+    if full:
+        names = image_names
+        trained = {}
+    else:
+        names = [n for n in image_names if n not in trained]
+        if not names:
+            print("[INFO] Model is up to date; no new samples.")
+            return
+
+    progress(0.1, f"Decoding {len(names)} images")
+    faces, labels, loaded, corrupt = _read_samples(names, label_map)
+    if not faces:
+        if full:
+            raise RuntimeError("No readable images to train on.")
+        # Only unreadable files are new; they were reported above and stay out of the manifest
+        print(f"[INFO] Model is up to date; {len(corrupt)} new samples are unreadable.")
+        return
+
+    # Unreadable files stay out of the manifest so they are retried (and reported) next run
+    trained = dict(trained)
+    trained.update({n: current[n] for n in loaded})
+    _fit_and_save(faces, labels, label_map, full, {"samples": trained, "face_size": face_size}, progress)
+
+
+def train(full=False, progress=None):
+    """
+    full: rebuild from every sample instead of updating with new ones.
+    progress: optional callback(fraction, message), e.g. from the dashboard job manager.
+    """
+    progress = progress or _no_progress
+    os.makedirs(TRAINER_DIR, exist_ok=True)
+    progress(0.0, "Loading samples")
+    store = SampleStore()
+    if store.exists():
+        _train_from_store(store, full, progress)
+    else:
+        _train_from_jpegs(full, progress)
+
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train the face recognizer.")
+    parser.add_argument("--full", action="store_true", help="rebuild the model from every sample")
+    args = parser.parse_args()
+    train(full=args.full)